@@ -1,43 +1,83 @@
-from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_ollama.llms import OllamaLLM
-from langchain_ollama.embeddings import OllamaEmbeddings
-from langchain_community.vectorstores import FAISS
+from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.documents import Document
 import gradio as gr
-from config import DB_DIR, EMBEDDING_MODEL, LLM_MODEL, QA_PROMPT
+import asyncio
+import atexit
+import os
+import time
+from typing import AsyncIterator, List
+from clients import EMBEDDINGS, CHAT_LLM, warm_up
+from faiss_store import load_vector_store, search_by_vectors
+from semantic_cache import SemanticCache
+from config import (DB_DIR, SYSTEM_PROMPT, USER_TEMPLATE, SEMANTIC_CACHE_DIR, GRADIO_CONCURRENCY_LIMIT,
+                    STREAM_UPDATE_INTERVAL)
 
 # 1️⃣ 向量数据库
-embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
-db = FAISS.load_local(DB_DIR, embeddings, allow_dangerous_deserialization=True)
-retriever = db.as_retriever()
-
-# 2️⃣ LLM
-llm = OllamaLLM(model=LLM_MODEL)
-
-# 3️⃣ Prompt
-prompt = PromptTemplate(
-    template=QA_PROMPT,
-    input_variables=["context", "query"]
-)
-
-# 4️⃣ QA Chain (使用现代 LCEL 语法)
-qa_chain = (
-    {"context": retriever, "query": RunnablePassthrough()}
-    | prompt
-    | llm
-)
+embeddings = EMBEDDINGS
+db = load_vector_store(embeddings, DB_DIR)
+
+
+def retrieve(query_vector: List[float], k: int = 4) -> List[Document]:
+    """使用已计算的查询向量检索文档（查询只向量化一次，与语义缓存共用）"""
+    return search_by_vectors(db, [query_vector], k)[0]
+
+
+def format_docs(docs: List[Document]) -> str:
+    """格式化检索到的文档"""
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+# 2️⃣ LLM（对话接口，系统提示作为固定前缀常驻KV缓存）
+llm = CHAT_LLM
+
+# 3️⃣ Prompt（系统提示 → 检索文档 → 问题），系统消息只构造一次
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+
+# 4️⃣ 生成（直接调用LLM，省去每次请求的 LCEL 链调度；逐块流式返回）
+async def generate_stream(context: str, query: str) -> AsyncIterator[str]:
+    human_message = HumanMessage(content=USER_TEMPLATE.format(context=context, query=query))
+    async for chunk in llm.astream([SYSTEM_MESSAGE, human_message]):
+        yield chunk.content
+
+# 语义缓存（相似问题直接返回已有回答）
+cache = SemanticCache(embeddings, cache_dir=os.path.join(SEMANTIC_CACHE_DIR, "basic"))
+atexit.register(cache.save)
 
 # -----------------------------
 # 5️⃣ 定义前端函数
 # -----------------------------
-def chat_with_agent(query):
+async def chat_with_agent(query):
+    """流式回答：首个token到达即可开始显示，之后最多每 STREAM_UPDATE_INTERVAL 秒刷新一次页面"""
     if not query.strip():
-        return "❌ 请输入问题"
+        yield "❌ 请输入问题"
+        return
     try:
-        result = qa_chain.invoke(query)
-        return result
+        # 查询只向量化一次，语义缓存和检索共用
+        query_vector = await embeddings.aembed_query(query)
+
+        cached = cache.get(query, vector=query_vector)
+        if cached:
+            yield cached["answer"]
+            return
+
+        # FAISS检索是同步计算，放到线程池中执行，不阻塞事件循环
+        docs = await asyncio.to_thread(retrieve, query_vector)
+
+        result = ""
+        last_yield = 0.0
+        async for token in generate_stream(format_docs(docs), query):
+            result += token
+            now = time.monotonic()
+            if now - last_yield >= STREAM_UPDATE_INTERVAL:
+                last_yield = now
+                yield result
+        # 最后一段可能被节流跳过，结束时补发完整回答
+        yield result
+
+        cache.put(query, result, vector=query_vector)
     except Exception as e:
-        return f"❌ 错误: {str(e)}"
+        yield f"❌ 错误: {str(e)}"
 
 # -----------------------------
 # 4️⃣ Gradio 前端美化
@@ -60,10 +100,12 @@ with gr.Blocks(title="🎓 英语学习智能体") as demo:
         submit = gr.Button("提问", variant="primary")
     
     output = gr.Markdown(label="回答")
-    submit.click(fn=chat_with_agent, inputs=query, outputs=output)
+    submit.click(fn=chat_with_agent, inputs=query, outputs=output,
+                 api_name="chat", concurrency_limit=GRADIO_CONCURRENCY_LIMIT)
 
 # -----------------------------
 # 5️⃣ 启动
 # -----------------------------
 if __name__ == "__main__":
+    warm_up()
     demo.launch(share=False, server_name="0.0.0.0", server_port=7862)
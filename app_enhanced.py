@@ -1,13 +1,16 @@
 # app_enhanced.py - 增强版RAG应用
 
-from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_ollama.llms import OllamaLLM
+from langchain_core.messages import SystemMessage, HumanMessage
 from retriever_enhanced import EnhancedRetriever
+from semantic_cache import SemanticCache
+from clients import CHAT_LLM, warm_up
 import gradio as gr
-from config import LLM_MODEL, QA_PROMPT
+from config import SYSTEM_PROMPT, USER_TEMPLATE, SEMANTIC_CACHE_DIR, GRADIO_CONCURRENCY_LIMIT
+import asyncio
+import atexit
+import os
 import time
-from typing import Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any
 
 
 class EnhancedRAGApp:
@@ -17,51 +20,52 @@ class EnhancedRAGApp:
         # 1️⃣ 增强检索器
         self.retriever = EnhancedRetriever()
 
-        # 2️⃣ LLM
-        self.llm = OllamaLLM(model=LLM_MODEL)
+        # 2️⃣ LLM（对话接口，系统提示作为固定前缀常驻KV缓存）
+        self.llm = CHAT_LLM
 
-        # 3️⃣ 增强的Prompt模板
-        self.prompt = PromptTemplate(
-            template=QA_PROMPT,
-            input_variables=["context", "query"]
-        )
+        # 3️⃣ 增强的Prompt模板（系统提示 → 检索文档 → 问题），系统消息只构造一次
+        self.system_message = SystemMessage(content=SYSTEM_PROMPT)
+        self.user_template = USER_TEMPLATE
 
         # 4️⃣ 创建多个处理链
         self._setup_chains()
 
-    def _setup_chains(self):
-        """设置不同的处理链"""
-        # 基础QA链
-        self.qa_chain = (
-            {"context": lambda q: self._get_formatted_docs(q), "query": RunnablePassthrough()}
-            | self.prompt
-            | self.llm
+        # 5️⃣ 语义缓存（按检索方法区分命名空间）
+        self.cache = SemanticCache(
+            self.retriever.embeddings,
+            cache_dir=os.path.join(SEMANTIC_CACHE_DIR, "enhanced")
         )
+        atexit.register(self.cache.save)
 
+    def _setup_chains(self):
+        """设置不同的处理链"""
         # 增强QA链（带检索质量分析）
         self.enhanced_qa_chain = self._create_enhanced_chain()
 
-    def _get_formatted_docs(self, query: str, method: str = "enhanced") -> str:
-        """获取并格式化检索到的文档"""
-        docs = self.retriever.get_relevant_documents(query, method=method)
+    async def _generate(self, context: str, query: str) -> str:
+        """基础QA：直接调用LLM生成回答（检索在调用前完成，省去每次请求的 LCEL 链调度）"""
+        human_message = HumanMessage(content=self.user_template.format(context=context, query=query))
+        message = await self.llm.ainvoke([self.system_message, human_message])
+        return message.content
+
+    def _format_docs(self, docs) -> str:
+        """格式化检索到的文档"""
         if not docs:
             return "未找到相关文档。"
 
-        formatted_docs = []
-        for i, doc in enumerate(docs, 1):
-            source = doc.metadata.get('source', f'文档片段{i}')
-            content = doc.page_content.strip()
-            formatted_docs.append(f"[文档{i} - {source}]:\n{content}")
-
-        return "\n\n".join(formatted_docs)
+        # 文档内容已在入库时去除首尾空白
+        return "\n\n".join(
+            f"[文档{i} - {doc.metadata.get('source', f'文档片段{i}')}]:\n{doc.page_content}"
+            for i, doc in enumerate(docs, 1)
+        )
 
     def _create_enhanced_chain(self):
         """创建增强的处理链"""
-        def enhanced_process(query: str) -> Tuple[str, Dict[str, Any]]:
-            start_time = time.time()
-
-            # 检索文档
-            docs = self.retriever.get_relevant_documents(query, method="enhanced")
+        async def enhanced_process(query: str, query_vector: List[float], start_ns: int) -> Tuple[str, Dict[str, Any]]:
+            # 检索文档（同步检索放到线程池，不阻塞事件循环）
+            docs = await asyncio.to_thread(
+                self.retriever.get_relevant_documents, query, "enhanced", query_vector
+            )
             retrieval_quality = self.retriever.analyze_retrieval_quality(query, docs)
 
             # 如果检索质量太低，给出提示
@@ -71,12 +75,11 @@ class EnhancedRAGApp:
                     "1. 使用更具体的关键词\n"
                     "2. 检查问题是否在英语学习范围内\n"
                     "3. 查看知识库中是否包含相关内容",
-                    {"retrieval_quality": retrieval_quality, "response_time": time.time() - start_time}
+                    {"retrieval_quality": retrieval_quality}
                 )
 
-            # 生成回答
-            formatted_docs = self._get_formatted_docs(query)
-            response = self.qa_chain.invoke(query)
+            # 生成回答（直接使用已检索到的文档）
+            response = await self._generate(self._format_docs(docs), query)
 
             # 添加检索质量信息
             quality_note = f"\n\n---\n📊 检索质量: {retrieval_quality['quality_score']:.1f}/100"
@@ -85,46 +88,63 @@ class EnhancedRAGApp:
 
             return response + quality_note, {
                 "retrieval_quality": retrieval_quality,
-                "response_time": time.time() - start_time,
+                "response_time": (time.perf_counter_ns() - start_ns) / 1e9,
                 "num_retrieved_docs": len(docs)
             }
 
         return enhanced_process
 
-    def chat_with_agent(self, query: str, method: str = "enhanced") -> Tuple[str, Dict[str, Any]]:
+    async def chat_with_agent(self, query: str, method: str = "enhanced") -> Tuple[str, Dict[str, Any]]:
         """与智能体对话"""
         if not query.strip():
             return "❌ 请输入问题", {}
 
         try:
+            start_ns = time.perf_counter_ns()
+
+            # 查询只向量化一次，语义缓存和检索共用
+            query_vector = await self.retriever.embeddings.aembed_query(query)
+            cached = self.cache.get(query, namespace=method, vector=query_vector)
+            if cached:
+                return cached["answer"], {
+                    **cached["metadata"],
+                    "response_time": (time.perf_counter_ns() - start_ns) / 1e9,
+                    "cache_hit": True
+                }
+
             if method == "enhanced":
                 # 使用增强链
-                response, metadata = self.enhanced_qa_chain(query)
+                response, metadata = await self.enhanced_qa_chain(query, query_vector, start_ns)
+                # 只缓存生成的回答（检索质量过低时的提示不缓存，知识库更新后同类问题可以重新检索）
+                if "num_retrieved_docs" in metadata:
+                    self.cache.put(query, response, metadata, namespace=method, vector=query_vector)
                 return response, metadata
             else:
                 # 使用指定方法
-                start_time = time.time()
-                docs = self.retriever.get_relevant_documents(query, method=method)
+                docs = await asyncio.to_thread(
+                    self.retriever.get_relevant_documents, query, method, query_vector
+                )
                 retrieval_quality = self.retriever.analyze_retrieval_quality(query, docs)
 
                 if not docs:
                     return "❌ 未找到相关文档", {"retrieval_quality": retrieval_quality}
 
-                formatted_docs = self._get_formatted_docs(query, method)
-                response = self.qa_chain.invoke(query)
+                response = await self._generate(self._format_docs(docs), query)
 
-                return response, {
+                metadata = {
                     "retrieval_quality": retrieval_quality,
-                    "response_time": time.time() - start_time,
+                    "response_time": (time.perf_counter_ns() - start_ns) / 1e9,
                     "num_retrieved_docs": len(docs)
                 }
+                self.cache.put(query, response, metadata, namespace=method, vector=query_vector)
+                return response, metadata
 
         except Exception as e:
             return f"❌ 错误: {str(e)}", {}
 
-    def get_retrieval_debug_info(self, query: str, method: str = "enhanced") -> Dict[str, Any]:
+    async def get_retrieval_debug_info(self, query: str, method: str = "enhanced") -> Dict[str, Any]:
         """获取检索调试信息"""
-        docs = self.retriever.get_relevant_documents(query, method=method)
+        docs = await asyncio.to_thread(self.retriever.get_relevant_documents, query, method)
         return self.retriever.analyze_retrieval_quality(query, docs)
 
 
@@ -184,8 +204,8 @@ with gr.Blocks(title="🎓 英语学习智能体 (增强版)", theme=gr.themes.S
         debug_info = gr.JSON(label="详细检索分析")
 
     # 绑定事件
-    def process_query(query_text, method_choice):
-        response, metadata = app.chat_with_agent(query_text, method_choice)
+    async def process_query(query_text, method_choice):
+        response, metadata = await app.chat_with_agent(query_text, method_choice)
 
         # 更新统计信息
         quality = metadata.get("retrieval_quality", {}).get("quality_score", 0)
@@ -194,20 +214,22 @@ with gr.Blocks(title="🎓 英语学习智能体 (增强版)", theme=gr.themes.S
 
         return response, quality, time_taken, num_docs
 
-    def get_debug_info(query_text, method_choice):
-        debug_data = app.get_retrieval_debug_info(query_text, method_choice)
+    async def get_debug_info(query_text, method_choice):
+        debug_data = await app.get_retrieval_debug_info(query_text, method_choice)
         return debug_data
 
     submit.click(
         fn=process_query,
         inputs=[query, method],
-        outputs=[output, quality_score, response_time, doc_count]
+        outputs=[output, quality_score, response_time, doc_count],
+        concurrency_limit=GRADIO_CONCURRENCY_LIMIT
     )
 
     debug_btn.click(
         fn=get_debug_info,
         inputs=[query, method],
-        outputs=[debug_info]
+        outputs=[debug_info],
+        concurrency_limit=GRADIO_CONCURRENCY_LIMIT
     )
 
     # 示例问题
@@ -225,5 +247,6 @@ with gr.Blocks(title="🎓 英语学习智能体 (增强版)", theme=gr.themes.S
 
 # 启动应用
 if __name__ == "__main__":
+    warm_up()
     demo.launch(share=False, server_name="0.0.0.0", server_port=7863)
     print("🚀 增强版RAG应用已启动: http://localhost:7863")
\ No newline at end of file
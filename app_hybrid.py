@@ -1,14 +1,22 @@
 # app_hybrid.py - 混合RAG应用（本地知识库 + 网络检索）
 
-from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_ollama.llms import OllamaLLM
+from langchain_core.messages import SystemMessage, HumanMessage
 from retriever_enhanced import EnhancedRetriever
 from web_search_integration import create_hybrid_retriever
+from semantic_cache import SemanticCache
+from clients import CHAT_LLM, warm_up
 import gradio as gr
-from config import LLM_MODEL
+from config import SEMANTIC_CACHE_DIR, GRADIO_CONCURRENCY_LIMIT
+import asyncio
+import atexit
+import os
 import time
-from typing import Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any
+from langchain_core.documents import Document
+
+# 来源标签格式
+_LOCAL_LABEL_FMT = "[本地资料]"
+_WEB_LABEL_FMT = "[网络资源 - {engine}]"
 
 
 class HybridRAGApp:
@@ -24,96 +32,85 @@ class HybridRAGApp:
             enable_web_search
         )
 
-        # 3️⃣ LLM
-        self.llm = OllamaLLM(model=LLM_MODEL)
+        # 3️⃣ LLM（对话接口，系统提示作为固定前缀常驻KV缓存）
+        self.llm = CHAT_LLM
 
-        # 4️⃣ 增强的Prompt模板（支持网络检索）
-        self.prompt = PromptTemplate(
-            template="""你是一个专业的英语学习助手。请根据提供的文档内容回答用户的问题。
+        # 4️⃣ 增强的Prompt模板（支持网络检索；系统提示 → 检索资料 → 问题），系统消息只构造一次
+        self.system_message = SystemMessage(content="""你是一个专业的英语学习助手。请根据提供的文档内容回答用户的问题。
 
 要求：
 1. 优先使用提供的相关文档信息进行回答
 2. 如果有网络检索结果，请特别注明这是来自网络的信息
 3. 给出具体的英文示例和用法说明
 4. 如果文档中找不到相关信息，请诚实地说明
-5. 回答要详细、准确、易懂
-
-**检索到的资料：**
+5. 回答要详细、准确、易懂""")
+        self.user_template = """**检索到的资料：**
 {context}
 
 **用户问题：**
 {query}
 
-**回答：**""",
-            input_variables=["context", "query"]
-        )
+**回答：**"""
 
-        # 5️⃣ 处理链
-        self.qa_chain = (
-            {"context": lambda q: self._get_formatted_docs(q), "query": RunnablePassthrough()}
-            | self.prompt
-            | self.llm
+        # 5️⃣ 语义缓存（按搜索模式区分命名空间，避免仅网络与仅本地的回答互相复用）
+        self.cache = SemanticCache(
+            self.local_retriever.embeddings,
+            cache_dir=os.path.join(SEMANTIC_CACHE_DIR, "hybrid")
         )
-
-    def _get_formatted_docs(self, query: str, use_local: bool = True, use_web: bool = True) -> str:
-        """获取并格式化检索到的文档"""
-        docs = self.hybrid_retriever.search_and_retrieve(query, use_local, use_web)
-
-        if not docs:
-            return "未找到相关学习资料。请尝试使用不同的关键词或检查网络连接。"
-
-        formatted_docs = []
-        local_count = 0
-        web_count = 0
-
-        for doc in docs:
-            source_type = doc.metadata.get("source_type", "unknown")
-            title = doc.metadata.get("title", "")
-            source = doc.metadata.get("source", "")
-
-            if source_type == "local":
-                local_count += 1
-                source_label = f"[本地文档{local_count}]"
-            else:
-                web_count += 1
-                engine = doc.metadata.get("engine", "网络")
-                source_label = f"[网络{web_count} - {engine}]"
-
-            content = doc.page_content.strip()
-            if title:
-                formatted_docs.append(f"{source_label} **{title}**:\n{content}")
-            else:
-                formatted_docs.append(f"{source_label}:\n{content}")
-
-        # 添加检索统计信息
-        header = f"📚 检索到 {local_count} 个本地文档和 {web_count} 个网络资源\n\n"
-
-        return header + "\n\n".join(formatted_docs)
-
-    def chat_with_agent(self,
-                       query: str,
-                       use_local: bool = True,
-                       use_web: bool = True,
-                       search_method: str = "hybrid") -> Tuple[str, Dict[str, Any]]:
+        atexit.register(self.cache.save)
+
+    async def _generate(self, context: str, query: str) -> str:
+        """直接调用LLM生成回答（检索在 chat_with_agent 中完成，省去每次请求的 LCEL 链调度）"""
+        human_message = HumanMessage(content=self.user_template.format(context=context, query=query))
+        message = await self.llm.ainvoke([self.system_message, human_message])
+        return message.content
+
+    async def _retrieve_docs(self,
+                             query: str,
+                             use_local: bool,
+                             use_web: bool,
+                             search_method: str,
+                             query_vector: List[float]) -> List[Document]:
+        """按搜索模式检索文档（本地检索放到线程池中执行，网络请求在事件循环上异步发出）"""
+        if search_method == "hybrid":
+            # 混合检索（本地与网络并发）
+            return await self.hybrid_retriever.asearch_and_retrieve(query, use_local, use_web, query_vector)
+        elif search_method == "local_only":
+            # 仅本地检索
+            return await asyncio.to_thread(
+                self.local_retriever.get_relevant_documents, query, "enhanced", query_vector
+            )
+        elif search_method == "web_only":
+            # 仅网络检索
+            return await self.hybrid_retriever._aweb_search(query)
+        else:
+            raise ValueError(f"未知的搜索模式: {search_method}")
+
+    async def chat_with_agent(self,
+                              query: str,
+                              use_local: bool = True,
+                              use_web: bool = True,
+                              search_method: str = "hybrid") -> Tuple[str, Dict[str, Any]]:
         """与智能体对话"""
         if not query.strip():
             return "❌ 请输入问题", {}
 
         try:
-            start_time = time.time()
+            start_ns = time.perf_counter_ns()
+
+            # 语义缓存
+            namespace = f"{search_method}|local={use_local}|web={use_web}"
+            query_vector = await self.local_retriever.embeddings.aembed_query(query)
+            cached = self.cache.get(query, namespace=namespace, vector=query_vector)
+            if cached:
+                return cached["answer"], {
+                    **cached["metadata"],
+                    "response_time": (time.perf_counter_ns() - start_ns) / 1e9,
+                    "cache_hit": True
+                }
 
             # 选择检索方法
-            if search_method == "hybrid":
-                # 混合检索
-                docs = self.hybrid_retriever.search_and_retrieve(query, use_local, use_web)
-            elif search_method == "local_only":
-                # 仅本地检索
-                docs = self.local_retriever.get_relevant_documents(query, method="enhanced")
-            elif search_method == "web_only":
-                # 仅网络检索
-                docs = self.hybrid_retriever._web_search(query)
-
-            response_time = time.time() - start_time
+            docs = await self._retrieve_docs(query, use_local, use_web, search_method, query_vector)
 
             # 分析检索质量
             retrieval_quality = self._analyze_hybrid_retrieval(docs, use_local, use_web)
@@ -129,27 +126,29 @@ class HybridRAGApp:
                     "4. 尝试更具体的问题描述",
                     {
                         "retrieval_quality": retrieval_quality,
-                        "response_time": response_time,
                         "num_retrieved_docs": 0,
                         "search_method": search_method
                     }
                 )
 
-            # 生成回答
+            # 生成回答（文档保持去重时的优先级顺序：本地文档在前）
             formatted_docs = self._get_docs_for_prompt(docs)
-            response = self.qa_chain.invoke({"context": formatted_docs, "query": query})
+            response = await self._generate(formatted_docs, query)
+            response_time = (time.perf_counter_ns() - start_ns) / 1e9
 
             # 添加检索质量信息
             quality_info = self._format_quality_info(retrieval_quality, docs)
             final_response = response + "\n\n" + quality_info
 
-            return final_response, {
+            metadata = {
                 "retrieval_quality": retrieval_quality,
                 "response_time": response_time,
                 "num_retrieved_docs": len(docs),
                 "search_method": search_method,
                 "docs_breakdown": self._get_docs_breakdown(docs)
             }
+            self.cache.put(query, final_response, metadata, namespace=namespace, vector=query_vector)
+            return final_response, metadata
 
         except Exception as e:
             return f"❌ 错误: {str(e)}", {}
@@ -157,24 +156,23 @@ class HybridRAGApp:
     def _get_docs_for_prompt(self, docs) -> str:
         """为Prompt准备格式化的文档"""
         formatted_docs = []
+        append = formatted_docs.append
 
         for doc in docs:
-            source_type = doc.metadata.get("source_type", "unknown")
-            title = doc.metadata.get("title", "")
-            source = doc.metadata.get("source", "")
-
-            if source_type == "local":
-                source_label = "[本地资料]"
+            metadata = doc.metadata
+            if metadata.get("source_type") == "local":
+                source_label = _LOCAL_LABEL_FMT
             else:
-                engine = doc.metadata.get("engine", "网络")
-                source_label = f"[网络资源 - {engine}]"
+                source_label = _WEB_LABEL_FMT.format(engine=metadata.get("engine", "网络"))
 
-            content = doc.page_content.strip()[:1000]  # 限制长度
+            # 文档内容已在入库/抓取时去除首尾空白，这里只限制长度
+            content = doc.page_content[:1000]
 
+            title = metadata.get("title")
             if title:
-                formatted_docs.append(f"{source_label} {title}:\n{content}")
+                append(f"{source_label} {title}:\n{content}")
             else:
-                formatted_docs.append(f"{source_label}:\n{content}")
+                append(f"{source_label}:\n{content}")
 
         return "\n\n".join(formatted_docs)
 
@@ -188,34 +186,32 @@ class HybridRAGApp:
                 "recommendations": ["未检索到文档，请检查查询参数"]
             }
 
-        # 统计文档类型
-        local_docs = [doc for doc in docs if doc.metadata.get("source_type") == "local"]
-        web_docs = [doc for doc in docs if doc.metadata.get("source_type") == "web"]
-
-        # 计算质量评分
-        content_lengths = [len(doc.page_content) for doc in docs]
-        avg_length = sum(content_lengths) / len(content_lengths)
+        # 直接按 source_type 计数（在入库/抓取时已写入），不再构建中间列表
+        n = len(docs)
+        num_local = sum(1 for doc in docs if doc.metadata.get("source_type") == "local")
+        num_web = sum(1 for doc in docs if doc.metadata.get("source_type") == "web")
+        avg_length = sum(len(doc.page_content) for doc in docs) / n
 
         # 综合评分
-        base_score = min(50, len(docs) * 10)  # 文档数量分数
+        base_score = min(50, n * 10)  # 文档数量分数
         length_score = min(30, avg_length / 50)  # 内容长度分数
-        diversity_score = min(20, len(local_docs) * 5 + len(web_docs) * 5)  # 多样性分数
+        diversity_score = min(20, num_local * 5 + num_web * 5)  # 多样性分数
 
         quality_score = base_score + length_score + diversity_score
 
         # 生成建议
         recommendations = []
-        if len(local_docs) == 0 and use_local:
+        if num_local == 0 and use_local:
             recommendations.append("本地知识库未找到相关内容，考虑添加更多学习资料")
-        if len(web_docs) == 0 and use_web:
+        if num_web == 0 and use_web:
             recommendations.append("网络搜索未返回结果，检查网络连接或尝试不同关键词")
         if quality_score < 60:
             recommendations.append("检索质量偏低，建议优化查询词或调整搜索策略")
 
         return {
             "quality_score": min(100, quality_score),
-            "num_local_docs": len(local_docs),
-            "num_web_docs": len(web_docs),
+            "num_local_docs": num_local,
+            "num_web_docs": num_web,
             "avg_content_length": avg_length,
             "recommendations": recommendations
         }
@@ -247,6 +243,10 @@ class HybridRAGApp:
 # 创建应用实例
 app = HybridRAGApp(enable_web_search=True)
 
+# 检索详情的字段（每个会话持有一份，按字段原地更新）
+_SEARCH_METADATA_KEYS = ("搜索模式", "本地检索", "网络搜索", "检索文档数",
+                         "本地文档数", "网络资源数", "质量评分", "响应时间")
+
 
 # Gradio界面
 with gr.Blocks(title="🎓 混合RAG英语学习助手", theme=gr.themes.Soft()) as demo:
@@ -310,12 +310,15 @@ with gr.Blocks(title="🎓 混合RAG英语学习助手", theme=gr.themes.Soft())
     with gr.Accordion("🔍 检索详情", open=False):
         search_info = gr.JSON(label="搜索分析", visible=True)
 
+    # 每个会话一份检索详情字典，请求间复用
+    search_metadata_state = gr.State(dict.fromkeys(_SEARCH_METADATA_KEYS))
+
     # 绑定事件
-    def process_query(query_text, local_enabled, web_enabled, method):
+    async def process_query(query_text, local_enabled, web_enabled, method, search_metadata):
         if not query_text.strip():
             return "❌ 请输入问题", 0, 0, 0, 0, {}
 
-        response, metadata = app.chat_with_agent(
+        response, metadata = await app.chat_with_agent(
             query_text, local_enabled, web_enabled, method
         )
 
@@ -326,23 +329,22 @@ with gr.Blocks(title="🎓 混合RAG英语学习助手", theme=gr.themes.Soft())
         quality = metadata.get("retrieval_quality", {}).get("quality_score", 0)
         time_taken = metadata.get("response_time", 0)
 
-        search_metadata = {
-            "搜索模式": method,
-            "本地检索": local_enabled,
-            "网络搜索": web_enabled,
-            "检索文档数": metadata.get("num_retrieved_docs", 0),
-            "本地文档数": local_num,
-            "网络资源数": web_num,
-            "质量评分": quality,
-            "响应时间": f"{time_taken:.3f}秒"
-        }
+        search_metadata["搜索模式"] = method
+        search_metadata["本地检索"] = local_enabled
+        search_metadata["网络搜索"] = web_enabled
+        search_metadata["检索文档数"] = metadata.get("num_retrieved_docs", 0)
+        search_metadata["本地文档数"] = local_num
+        search_metadata["网络资源数"] = web_num
+        search_metadata["质量评分"] = quality
+        search_metadata["响应时间"] = format(time_taken, ".3f") + "秒"
 
         return response, local_num, web_num, quality, time_taken, search_metadata
 
     submit.click(
         fn=process_query,
-        inputs=[query, use_local, use_web, search_method],
-        outputs=[output, local_count, web_count, quality_score, response_time, search_info]
+        inputs=[query, use_local, use_web, search_method, search_metadata_state],
+        outputs=[output, local_count, web_count, quality_score, response_time, search_info],
+        concurrency_limit=GRADIO_CONCURRENCY_LIMIT
     )
 
     clear_btn.click(
@@ -395,5 +397,6 @@ with gr.Blocks(title="🎓 混合RAG英语学习助手", theme=gr.themes.Soft())
 # 启动应用
 if __name__ == "__main__":
     print("🚀 混合RAG英语学习助手启动中...")
+    warm_up()
     demo.launch(share=False, server_name="0.0.0.0", server_port=7864)
     print("✅ 应用已启动: http://localhost:7864")
\ No newline at end of file
@@ -1,14 +1,17 @@
 # app_with_memory.py - 带上下文记忆功能的RAG应用
 
-from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_ollama.llms import OllamaLLM
+from langchain_core.runnables import RunnableLambda
 from retriever_enhanced import EnhancedRetriever
-from conversation_memory import ConversationMemory, get_conversation_memory
+from conversation_memory import get_conversation_memory
+from clients import CHAT_LLM, warm_up
+from semantic_cache import SemanticCache
+from config import SEMANTIC_CACHE_DIR, MEMORY_CACHE_THRESHOLD, MEMORY_CACHE_MAX_SIZE, STREAM_UPDATE_INTERVAL
 import gradio as gr
-from config import LLM_MODEL
+import asyncio
+import atexit
+import os
 import time
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, AsyncIterator, Optional
 import json
 
 
@@ -22,12 +25,12 @@ class ConversationRAGApp:
         # 2️⃣ 对话记忆
         self.memory = get_conversation_memory()
 
-        # 3️⃣ LLM
-        self.llm = OllamaLLM(model=LLM_MODEL)
+        # 3️⃣ LLM（异步流式接口）
+        self.llm = CHAT_LLM
 
         # 4️⃣ 增强的Prompt模板（支持上下文记忆）
-        self.prompt_with_context = PromptTemplate(
-            template="""你是一个专业的英语学习助手。请根据提供的文档和对话历史，全面回答用户的问题。
+        # 模板固定不变，直接用 str.format_map 填充，省去 PromptTemplate 每次调用的解析和校验
+        self.prompt_with_context = RunnableLambda("""你是一个专业的英语学习助手。请根据提供的文档和对话历史，全面回答用户的问题。
 
 **对话历史上下文：**
 {conversation_context}
@@ -46,64 +49,112 @@ class ConversationRAGApp:
 5. 保持回答的连贯性和一致性
 6. 如果发现了之前可能的错误，请主动纠正和澄清
 
-**回答：**""",
-            input_variables=["conversation_context", "retrieved_docs", "query"]
-        )
+**回答：**""".format_map)
 
-        # 5️⃣ 处理链
-        self.qa_chain = (
-            {
-                "conversation_context": lambda q: self.memory.get_context_for_query(q),
-                "retrieved_docs": lambda q: self._get_retrieved_docs(q),
-                "query": RunnablePassthrough()
-            }
-            | self.prompt_with_context
-            | self.llm
+        # 5️⃣ 处理链（对话上下文和检索结果由 chat_with_memory 准备好后传入，每轮只检索一次）
+        self.qa_chain = self.prompt_with_context | self.llm
+
+        # 简单回答（不使用记忆）的Prompt和处理链，同样只构造一次
+        self.simple_prompt = RunnableLambda("""请根据提供的英语学习资料回答用户问题：
+
+资料：
+{docs}
+
+问题：{query}
+
+请给出详细准确的回答。""".format_map)
+        self.simple_chain = self.simple_prompt | self.llm
+
+        # 6️⃣ 语义缓存：只缓存不依赖对话历史的回答（带上下文的回答随历史变化，不能复用）
+        self.cache = SemanticCache(
+            self.retriever.embeddings,
+            threshold=MEMORY_CACHE_THRESHOLD,
+            max_size=MEMORY_CACHE_MAX_SIZE,
+            cache_dir=os.path.join(SEMANTIC_CACHE_DIR, "memory")
         )
+        atexit.register(self.cache.save)
 
-    def _get_retrieved_docs(self, query: str) -> str:
-        """获取检索到的文档"""
-        try:
-            docs = self.retriever.get_relevant_documents(query, method="enhanced")
-            if not docs:
-                return "未找到相关的英语学习资料。"
+    def _format_docs(self, docs) -> str:
+        """格式化检索到的文档（带记忆回答和简单回答共用同一份文本）"""
+        if not docs:
+            return "未找到相关的英语学习资料。"
 
-            formatted_docs = []
-            for i, doc in enumerate(docs, 1):
-                source = doc.metadata.get('source', f'文档片段{i}')
-                content = doc.page_content.strip()[:800]  # 限制长度
-                formatted_docs.append(f"[资料{i} - {source}]:\n{content}")
+        formatted_docs = []
+        for i, doc in enumerate(docs, 1):
+            source = doc.metadata.get('source', f'文档片段{i}')
+            content = doc.page_content[:800]  # 限制长度（内容已在入库时去除首尾空白）
+            formatted_docs.append(f"[资料{i} - {source}]:\n{content}")
 
-            return "\n\n".join(formatted_docs)
-        except Exception as e:
-            return f"检索文档时出错: {str(e)}"
+        return "\n\n".join(formatted_docs)
 
-    def chat_with_memory(self, query: str, use_memory: bool = True) -> Tuple[str, Dict[str, Any]]:
-        """带记忆的对话"""
+    async def chat_with_memory(self, query: str, use_memory: bool = True) -> AsyncIterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        """带记忆的对话（流式）：生成过程中产出 (已生成内容, None)，结束时产出 (完整回答, 元数据)"""
         if not query.strip():
-            return "❌ 请输入问题", {}
+            yield "❌ 请输入问题", {}
+            return
 
         try:
-            start_time = time.time()
+            start_ns = time.perf_counter_ns()
+
+            # 查询只向量化一次，对话记忆、语义缓存和检索共用
+            query_vector = await self.retriever.embeddings.aembed_query(query)
 
             # 获取对话上下文
             conversation_context = ""
             if use_memory and self.memory.conversation_history:
-                conversation_context = self.memory.get_context_for_query(query)
+                conversation_context = self.memory.get_context_for_query(query, query_vector=query_vector)
 
-            # 检索相关文档
-            docs = self.retriever.get_relevant_documents(query, method="enhanced")
-            retrieval_quality = self.retriever.analyze_retrieval_quality(query, docs)
+            # 没有对话上下文时回答只取决于问题本身，命中缓存则跳过检索和生成
+            cached = None
+            if not conversation_context:
+                cached = self.cache.get(query, vector=query_vector)
 
-            # 如果启用记忆且有上下文
-            if use_memory and conversation_context:
-                # 使用带上下文的处理链
-                response = self.qa_chain.invoke(query)
+            if cached:
+                response = cached["answer"]
+                retrieval_quality = cached["metadata"]["retrieval_quality"]
+                sources = cached["metadata"]["sources"]
             else:
-                # 简单回答（无记忆）
-                response = self._simple_answer(query, docs)
-
-            response_time = time.time() - start_time
+                # 检索相关文档（每轮只检索一次；FAISS检索是同步计算，放到线程池中执行）
+                docs = await asyncio.to_thread(
+                    self.retriever.get_relevant_documents, query, "enhanced", query_vector
+                )
+                retrieval_quality = self.retriever.analyze_retrieval_quality(query, docs)
+                sources = [doc.metadata.get("source", "unknown") for doc in docs]
+                docs_text = self._format_docs(docs)
+
+                # 如果启用记忆且有上下文
+                if conversation_context:
+                    # 使用带上下文的处理链
+                    stream = self.qa_chain.astream({
+                        "conversation_context": conversation_context,
+                        "retrieved_docs": docs_text,
+                        "query": query
+                    })
+                elif docs:
+                    # 简单回答（无记忆）
+                    stream = self._simple_answer(query, docs_text)
+                else:
+                    stream = None
+                    response = "抱歉，没有找到相关的英语学习资料。请尝试其他问题。"
+
+                if stream is not None:
+                    # 逐段累积生成内容，页面刷新按间隔节流
+                    response = ""
+                    last_yield = 0.0  # 首段内容立即显示
+                    async for chunk in stream:
+                        response += chunk.content
+                        now = time.monotonic()
+                        if now - last_yield >= STREAM_UPDATE_INTERVAL:
+                            last_yield = now
+                            yield response, None
+
+                if docs and not conversation_context:
+                    self.cache.put(query, response, {
+                        "retrieval_quality": retrieval_quality,
+                        "sources": sources
+                    }, vector=query_vector)
+
+            response_time = (time.perf_counter_ns() - start_ns) / 1e9
 
             # 保存对话记录
             if use_memory:
@@ -113,49 +164,30 @@ class ConversationRAGApp:
                     metadata={
                         "response_time": response_time,
                         "retrieval_quality": retrieval_quality.get("quality_score", 0),
-                        "num_docs": len(docs)
+                        "num_docs": len(sources)
                     },
-                    retrieved_docs=[doc.metadata.get("source", "unknown") for doc in docs]
+                    retrieved_docs=sources
                 )
 
             # 添加记忆信息
             memory_info = self._format_memory_info(use_memory, conversation_context)
             final_response = response + "\n\n" + memory_info
 
-            return final_response, {
+            yield final_response, {
                 "retrieval_quality": retrieval_quality,
                 "response_time": response_time,
-                "num_retrieved_docs": len(docs),
+                "num_retrieved_docs": len(sources),
                 "memory_enabled": use_memory,
-                "conversation_length": len(self.memory.conversation_history) if use_memory else 0
+                "conversation_length": len(self.memory.conversation_history) if use_memory else 0,
+                "cache_hit": cached is not None
             }
 
         except Exception as e:
-            return f"❌ 错误: {str(e)}", {}
-
-    def _simple_answer(self, query: str, docs) -> str:
-        """简单回答（不使用记忆）"""
-        if not docs:
-            return "抱歉，没有找到相关的英语学习资料。请尝试其他问题。"
-
-        # 简单的Prompt
-        simple_prompt = PromptTemplate(
-            template="""请根据提供的英语学习资料回答用户问题：
+            yield f"❌ 错误: {str(e)}", {}
 
-资料：
-{docs}
-
-问题：{query}
-
-请给出详细准确的回答。""",
-            input_variables=["docs", "query"]
-        )
-
-        # 格式化文档
-        docs_text = "\n\n".join([f"资料{i+1}: {doc.page_content[:500]}..." for i, doc in enumerate(docs)])
-
-        chain = simple_prompt | self.llm
-        return chain.invoke({"docs": docs_text, "query": query})
+    def _simple_answer(self, query: str, docs_text: str) -> AsyncIterator:
+        """简单回答（不使用记忆），逐段返回生成内容"""
+        return self.simple_chain.astream({"docs": docs_text, "query": query})
 
     def _format_memory_info(self, use_memory: bool, context: str) -> str:
         """格式化记忆信息"""
@@ -278,11 +310,15 @@ with gr.Blocks(title="🧠 智能记忆RAG英语助手", theme=gr.themes.Soft())
         )
 
     # 绑定事件
-    def process_query(query_text, memory_enabled):
+    async def process_query(query_text, memory_enabled):
         if not query_text.strip():
-            return "❌ 请输入问题", 0, 0, 0, 0, 0, ""
+            yield "❌ 请输入问题", *[gr.update()] * 8
+            return
 
-        response, metadata = app.chat_with_memory(query_text, memory_enabled)
+        # 生成过程中只刷新回答区域，其余统计在回答完成后更新
+        async for response, metadata in app.chat_with_memory(query_text, memory_enabled):
+            if metadata is None:
+                yield response, *[gr.update()] * 8
 
         # 更新统计信息
         stats = app.get_conversation_stats()
@@ -304,7 +340,7 @@ with gr.Blocks(title="🧠 智能记忆RAG英语助手", theme=gr.themes.Soft())
         if memory_enabled and metadata.get("conversation_length", 0) > 0:
             memory_status_text += f" - {metadata['conversation_length']}轮对话"
 
-        return (
+        yield (
             response,  # output
             total_conv,  # total_conversations
             current_sess,  # current_session
@@ -316,7 +352,7 @@ with gr.Blocks(title="🧠 智能记忆RAG英语助手", theme=gr.themes.Soft())
             memory_status_text  # memory_status
         )
 
-    def clear_conversation_handler():
+    async def clear_conversation_handler():
         message = app.clear_memory()
         stats = app.get_conversation_stats()
         return (
@@ -329,25 +365,30 @@ with gr.Blocks(title="🧠 智能记忆RAG英语助手", theme=gr.themes.Soft())
             "已启用 - 新会话"
         )
 
-    def export_conversation_handler(export_fmt):
+    async def export_conversation_handler(export_fmt):
         try:
             content = app.export_conversation(export_fmt)
             return content
         except Exception as e:
             return f"导出失败: {str(e)}"
 
-    def update_memory_checkbox(memory_enabled):
+    async def update_memory_checkbox(memory_enabled):
         status = "已启用 - 可记住对话历史" if memory_enabled else "已关闭"
         return status
 
     # 绑定事件
+    # 所有会话共用同一个对话记忆（get_conversation_memory 单例）：读取上下文 → 生成 → 写入新一轮
+    # 之间不能穿插其他用户的请求，否则各用户的对话历史和统计会互相混入。
+    # 提问、清空、导出放在同一并发组，一次只处理一个（其他请求排队）
     submit.click(
         fn=process_query,
         inputs=[query, use_memory],
         outputs=[
             output, total_conversations, current_session, avg_response_length,
             quality_score, response_time, docs_count, topics_display, memory_status
-        ]
+        ],
+        concurrency_limit=1,
+        concurrency_id="conversation_memory"
     )
 
     clear_conversation.click(
@@ -355,13 +396,17 @@ with gr.Blocks(title="🧠 智能记忆RAG英语助手", theme=gr.themes.Soft())
         outputs=[
             output, total_conversations, current_session, avg_response_length,
             quality_score, response_time, docs_count, topics_display, memory_status
-        ]
+        ],
+        concurrency_limit=1,
+        concurrency_id="conversation_memory"
     )
 
     export_btn.click(
         fn=export_conversation_handler,
         inputs=[export_format],
-        outputs=[export_output]
+        outputs=[export_output],
+        concurrency_limit=1,
+        concurrency_id="conversation_memory"
     )
 
     use_memory.change(
@@ -412,5 +457,6 @@ with gr.Blocks(title="🧠 智能记忆RAG英语助手", theme=gr.themes.Soft())
 # 启动应用
 if __name__ == "__main__":
     print("🧠 智能记忆RAG英语助手启动中...")
+    warm_up()
     demo.launch(share=False, server_name="0.0.0.0", server_port=7865)
     print("✅ 应用已启动: http://localhost:7865")
\ No newline at end of file
@@ -0,0 +1,20 @@
+# build_ann_index.py - 为已有知识库离线构建近似索引（IVF-PQ / HNSW）
+
+import sys
+from clients import EMBEDDINGS
+from faiss_store import load_vector_store, save_ann_index
+from config import DB_DIR, FAISS_ANN_INDEX
+
+
+def main(index_type: str = FAISS_ANN_INDEX):
+    if index_type == "flat":
+        print("ℹ️ FAISS_ANN_INDEX 为 flat，无需构建近似索引")
+        return
+
+    db = load_vector_store(EMBEDDINGS, DB_DIR, use_ann=False)
+    print(f"📚 知识库共 {db.index.ntotal} 个向量，构建 {index_type} 索引...")
+    save_ann_index(db, DB_DIR, index_type)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else FAISS_ANN_INDEX)
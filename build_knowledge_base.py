@@ -3,28 +3,48 @@
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import OllamaEmbeddings
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
-from config import DOCS_DIR, DB_DIR, EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP
+from clients import EMBEDDINGS
+from faiss_store import VECTOR_STORE_KWARGS, save_ann_index
+from config import (DOCS_DIR, DB_DIR, CHUNK_SIZE, CHUNK_OVERLAP, FAISS_ANN_INDEX,
+                    INGEST_WORKERS, EMBED_BATCH_SIZE)
 
+LOADERS = {
+    ".pdf": PyPDFLoader,
+    ".docx": Docx2txtLoader,
+    ".txt": TextLoader,
+}
 
-def load_and_index_documents():
-    docs = []
 
-    for filename in os.listdir(DOCS_DIR):
-        path = os.path.join(DOCS_DIR, filename)
+def load_document(filename):
+    """加载单个文档，不支持的格式返回空列表"""
+    loader_cls = LOADERS.get(os.path.splitext(filename)[1])
+    if loader_cls is None:
+        print(f"⚠️ 跳过不支持的文件格式: {filename}")
+        return []
+    return loader_cls(os.path.join(DOCS_DIR, filename)).load()
+
+
+async def embed_texts(texts):
+    """分批并发向量化（同时最多 INGEST_WORKERS 个请求）"""
+    semaphore = asyncio.Semaphore(INGEST_WORKERS)
+
+    async def embed_batch(batch):
+        async with semaphore:
+            return await EMBEDDINGS.aembed_documents(batch)
 
-        if filename.endswith(".pdf"):
-            loader = PyPDFLoader(path)
-        elif filename.endswith(".docx"):
-            loader = Docx2txtLoader(path)
-        elif filename.endswith(".txt"):
-            loader = TextLoader(path)
-        else:
-            print(f"⚠️ 跳过不支持的文件格式: {filename}")
-            continue
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    return [vector for batch_vectors in results for vector in batch_vectors]
 
-        docs.extend(loader.load())
+
+def load_and_index_documents():
+    # 文档解析（PDF/DOCX）互不依赖，用线程池并行加载
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+        docs = [doc for doc_list in executor.map(load_document, sorted(os.listdir(DOCS_DIR)))
+                for doc in doc_list]
 
     if not docs:
         print("❌ 没有找到可用文档，请在 docs/ 文件夹中添加教材或笔记。")
@@ -35,11 +55,23 @@ def load_and_index_documents():
         chunk_overlap=CHUNK_OVERLAP
     )
     split_docs = splitter.split_documents(docs)
+    # 入库前去除首尾空白并标记来源类型，检索后格式化/统计时无需重复处理
+    for doc in split_docs:
+        doc.page_content = doc.page_content.strip()
+        doc.metadata["source_type"] = "local"
     print(f"📚 已加载 {len(split_docs)} 个文档块")
 
-    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
-    db = FAISS.from_documents(split_docs, embeddings)
+    texts = [doc.page_content for doc in split_docs]
+    vectors = asyncio.run(embed_texts(texts))
+    db = FAISS.from_embeddings(
+        list(zip(texts, vectors)),
+        EMBEDDINGS,
+        metadatas=[doc.metadata for doc in split_docs],
+        **VECTOR_STORE_KWARGS
+    )
     db.save_local(DB_DIR)
+    if FAISS_ANN_INDEX != "flat":
+        save_ann_index(db, DB_DIR)
 
     print(f"✅ 知识库构建完成，保存于: {DB_DIR}")
 
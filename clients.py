@@ -0,0 +1,197 @@
+# clients.py - 共享的 Ollama / HTTP 客户端（各模块共用同一连接池）
+
+import asyncio
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+import ollama
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from langchain_core.embeddings import Embeddings
+from langchain_ollama.chat_models import ChatOllama
+from langchain_ollama.embeddings import OllamaEmbeddings
+from langchain_ollama.llms import OllamaLLM
+from config import (EMBEDDING_MODEL, EMBEDDING_BACKEND, LLM_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_PREDICT, OLLAMA_STOP,
+                    OLLAMA_HTTP_RETRIES, HTTP_POOL_SIZE, HTTP_RETRIES, HTTP_USER_AGENT,
+                    HTTP_TIMEOUT, HTTP_DNS_CACHE_TTL, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL)
+from semantic_cache import normalize_query
+
+if TYPE_CHECKING:
+    import aiohttp
+
+# 0️⃣ 所有 Ollama 客户端共用同一组 httpx 传输层（同一个 keep-alive 连接池，连接失败自动重试）
+_OLLAMA_SYNC_TRANSPORT = httpx.HTTPTransport(retries=OLLAMA_HTTP_RETRIES)
+_OLLAMA_ASYNC_TRANSPORT = httpx.AsyncHTTPTransport(retries=OLLAMA_HTTP_RETRIES)
+_OLLAMA_CLIENT_KWARGS = {
+    "sync_client_kwargs": {"transport": _OLLAMA_SYNC_TRANSPORT},
+    "async_client_kwargs": {"transport": _OLLAMA_ASYNC_TRANSPORT},
+}
+
+# 1️⃣ 向量化模型（查询向量经过 LRU+TTL 缓存，同一问题在语义缓存、对话记忆、检索器之间只计算一次）
+def _create_base_embeddings() -> Embeddings:
+    """按 EMBEDDING_BACKEND 创建向量化模型，本地 ONNX 不可用时回退到 Ollama"""
+    if EMBEDDING_BACKEND == "onnx":
+        try:
+            from onnx_embeddings import OnnxEmbeddings
+            embeddings = OnnxEmbeddings()
+            print("✅ 使用本地 ONNX Runtime 向量化模型")
+            return embeddings
+        except Exception as e:
+            print(f"⚠️ 本地 ONNX 向量化模型不可用，使用 Ollama: {e}")
+    return OllamaEmbeddings(model=EMBEDDING_MODEL, **_OLLAMA_CLIENT_KWARGS)
+
+
+_BASE_EMBEDDINGS = _create_base_embeddings()
+
+# 规范化查询 → (写入时间, 向量)
+_embedding_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+_embedding_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _cache_lookup(key: str) -> Optional[np.ndarray]:
+    with _embedding_cache_lock:
+        item = _embedding_cache.get(key)
+        if item is not None and time.monotonic() - item[0] <= EMBEDDING_CACHE_TTL:
+            _embedding_cache.move_to_end(key)
+            _embedding_cache_stats["hits"] += 1
+            return item[1]
+        if item is not None:
+            del _embedding_cache[key]
+        _embedding_cache_stats["misses"] += 1
+        return None
+
+
+def _cache_store(key: str, vector: np.ndarray) -> None:
+    with _embedding_cache_lock:
+        _embedding_cache[key] = (time.monotonic(), vector)
+        _embedding_cache.move_to_end(key)
+        while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+
+
+def cached_embed(text: str) -> np.ndarray:
+    """带缓存的查询向量化（规范化后的文本相同即复用向量）"""
+    key = normalize_query(text)
+    vector = _cache_lookup(key)
+    if vector is None:
+        vector = np.asarray(_BASE_EMBEDDINGS.embed_query(text), dtype=np.float32)
+        _cache_store(key, vector)
+    return vector
+
+
+async def acached_embed(text: str) -> np.ndarray:
+    """cached_embed 的异步版本"""
+    key = normalize_query(text)
+    vector = _cache_lookup(key)
+    if vector is None:
+        vector = np.asarray(await _BASE_EMBEDDINGS.aembed_query(text), dtype=np.float32)
+        _cache_store(key, vector)
+    return vector
+
+
+def get_embedding_cache_stats() -> Dict[str, Any]:
+    """查询向量缓存的命中统计"""
+    with _embedding_cache_lock:
+        hits, misses = _embedding_cache_stats["hits"], _embedding_cache_stats["misses"]
+        return {
+            "size": len(_embedding_cache),
+            "max_size": EMBEDDING_CACHE_SIZE,
+            "ttl": EMBEDDING_CACHE_TTL,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        }
+
+
+def clear_embedding_cache() -> None:
+    """清空查询向量缓存及统计"""
+    with _embedding_cache_lock:
+        _embedding_cache.clear()
+        _embedding_cache_stats["hits"] = _embedding_cache_stats["misses"] = 0
+
+
+class CachedEmbeddings(Embeddings):
+    """查询走 cached_embed，文档批量向量化直接透传给底层模型"""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return _BASE_EMBEDDINGS.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await _BASE_EMBEDDINGS.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return cached_embed(text).tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await acached_embed(text)).tolist()
+
+
+EMBEDDINGS = CachedEmbeddings()
+
+# 2️⃣ LLM（对话接口，系统提示作为固定前缀常驻KV缓存）
+CHAT_LLM = ChatOllama(model=LLM_MODEL, keep_alive=OLLAMA_KEEP_ALIVE,
+                      num_predict=OLLAMA_NUM_PREDICT, stop=OLLAMA_STOP, **_OLLAMA_CLIENT_KWARGS)
+
+# 3️⃣ LLM（文本补全接口，供 PromptTemplate 链使用）
+LLM = OllamaLLM(model=LLM_MODEL, keep_alive=OLLAMA_KEEP_ALIVE,
+                num_predict=OLLAMA_NUM_PREDICT, stop=OLLAMA_STOP, **_OLLAMA_CLIENT_KWARGS)
+
+# 4️⃣ 网络检索用的 HTTP 会话（keep-alive 复用TCP/TLS连接，requests 默认已请求 gzip 压缩）
+HTTP = requests.Session()
+_adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE,
+                       max_retries=Retry(total=HTTP_RETRIES, backoff_factor=0.2,
+                                         status_forcelist=(502, 503, 504)))
+HTTP.mount("http://", _adapter)
+HTTP.mount("https://", _adapter)
+HTTP.headers["User-Agent"] = HTTP_USER_AGENT
+
+# 5️⃣ 异步网络检索用的 aiohttp 会话（绑定创建它的事件循环，每个事件循环共用一个）
+# aiohttp 只有网络检索需要，首次使用时才导入（未安装时不影响纯本地的应用）
+_async_http: Optional["aiohttp.ClientSession"] = None
+_async_http_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_async_http() -> "aiohttp.ClientSession":
+    """当前事件循环共用的 aiohttp 会话（连接池 + DNS 缓存），首次调用时创建"""
+    global _async_http, _async_http_loop
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    if _async_http is None or _async_http.closed or _async_http_loop is not loop:
+        _async_http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=HTTP_DNS_CACHE_TTL),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            headers={"User-Agent": HTTP_USER_AGENT}
+        )
+        _async_http_loop = loop
+    return _async_http
+
+
+@atexit.register
+def _close_async_http() -> None:
+    """退出时关闭 aiohttp 会话（事件循环已关闭时无法再关闭，交给解释器回收）"""
+    if _async_http is None or _async_http.closed or _async_http_loop is None:
+        return
+    if _async_http_loop.is_closed() or _async_http_loop.is_running():
+        return
+    _async_http_loop.run_until_complete(_async_http.close())
+
+
+def warm_up() -> None:
+    """预加载向量化模型和LLM，避免首个用户请求承担模型加载耗时"""
+    try:
+        _BASE_EMBEDDINGS.embed_query("warmup")
+        # 不带 prompt 的 generate 请求只加载模型，不生成内容
+        ollama.Client(host=CHAT_LLM.base_url, transport=_OLLAMA_SYNC_TRANSPORT).generate(
+            model=LLM_MODEL, keep_alive=OLLAMA_KEEP_ALIVE
+        )
+        print("🔥 Ollama 模型已预热")
+    except Exception as e:
+        print(f"⚠️ 模型预热失败（首次请求可能较慢）: {e}")
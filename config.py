@@ -7,21 +7,94 @@ DB_DIR = os.path.join(os.path.dirname(__file__), "vector_store")
 
 # 🦙 模型设置
 EMBEDDING_MODEL = "all-minilm"       # 用于文本向量化
+EMBEDDING_BACKEND = "ollama"         # 向量化后端: ollama / onnx（本地 ONNX Runtime int8 推理，需安装 optimum[onnxruntime]）
+ONNX_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"  # 与 Ollama 的 all-minilm 为同一模型
+ONNX_MODEL_DIR = os.path.join(os.path.dirname(__file__), "onnx_model")  # 导出并量化后的模型目录
+ONNX_MAX_LENGTH = 256                # 输入最大 token 数
 LLM_MODEL = "llama3.1:8b"            # Ollama 模型名
 
+# 🔍 向量检索
+FAISS_NUM_THREADS = os.cpu_count() or 1  # FAISS 检索使用的线程数
+FAISS_ANN_INDEX = "sq8"              # 近似索引类型: sq8 / pqrefine / ivfsq8 / ivfpq / hnsw / flat（flat 即暴力检索）
+IVF_NLIST = 256                      # IVF 聚类中心数
+IVF_NPROBE = 8                       # 检索时访问的聚类数
+PQ_M = 16                            # PQ 子向量数（需整除向量维度）
+PQ_NBITS = 8                         # 每个子向量的编码位数
+REFINE_K_FACTOR = 16                 # pqrefine: PQ 粗排取回 k×该倍数个候选，再用原始向量精排
+HNSW_M = 32                          # HNSW 每个节点的邻居数
+HNSW_EF_SEARCH = 64                  # HNSW 检索时的候选队列长度
+ANN_AUTO_BUILD_MIN = 10_000          # 启动时仍为平坦索引且向量数超过该值，自动构建近似索引
+FAISS_MMAP = True                    # 以只读内存映射方式加载索引文件（多进程共享页缓存）
+FAISS_USE_GPU = True                 # 检测到 NVIDIA GPU（faiss-gpu）时将索引放到GPU上检索
+FAISS_GPU_DEVICE = 0                 # 使用的GPU编号
+
+# 🧮 查询向量缓存
+EMBEDDING_CACHE_SIZE = 500           # 最多缓存的查询向量数（超出按LRU淘汰）
+EMBEDDING_CACHE_TTL = 1800           # 查询向量缓存有效期（秒）
+
+# 💭 对话记忆
+MEMORY_FAISS_MIN_HISTORY = 256       # max_history 超过该值时用 FAISS 索引检索历史（否则 numpy 矩阵乘法更快）
+MEMORY_SEARCH_K = 20                 # FAISS 检索历史时返回的最相关轮数（足够填满上下文长度）
+MEMORY_RECENCY_WEIGHT = 0.1          # 历史排序时的时间加权：最近一轮加满该值，越早越少（叠加在余弦相似度上）
+
 # 🪄 分块策略
 CHUNK_SIZE = 800
 CHUNK_OVERLAP = 100
 
+# 🏗️ 知识库构建
+INGEST_WORKERS = 8                   # 并行加载文档的线程数 / 同时发出的向量化请求数（与 OLLAMA_NUM_PARALLEL 对应）
+EMBED_BATCH_SIZE = 64                # 每个向量化请求包含的文档块数
+
+# 🦙 Ollama 生成参数
+OLLAMA_KEEP_ALIVE = "30m"            # 模型常驻时间，保持系统提示的KV缓存不被释放（内存充足时可设为 -1 常驻）
+OLLAMA_NUM_PREDICT = 512             # 单次回答最多生成的token数
+OLLAMA_STOP = ["\n\n**用户问题", "\n\n问题："]  # 模型开始复述Prompt模板时立即停止生成
+OLLAMA_HTTP_RETRIES = 2              # 连接 Ollama 失败时的重试次数
+
+# 🌐 网络检索
+HTTP_POOL_SIZE = 32                  # 每个主机保持的 keep-alive 连接数
+HTTP_RETRIES = 2                     # 连接失败或 502/503/504 时的重试次数
+HTTP_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+HTTP_TIMEOUT = 10                    # 异步请求的总超时（秒）
+HTTP_DNS_CACHE_TTL = 300             # 异步请求的 DNS 缓存时间（秒）
+HTTP_CACHE_TTL = 600                 # 搜索接口响应的缓存时间（秒），响应带 Cache-Control: max-age 时以其为准
+HTTP_CACHE_MAX_SIZE = 512            # 最多缓存的响应数（超出按LRU淘汰）
+WEB_EXTRACT_CACHE_SIZE = 64          # 缓存的网页正文数（页面未变化时跳过 HTML 解析）
+WEB_EXTRACT_MAX_BYTES = 256 * 1024   # 提取正文时最多下载的页面字节数（正文通常在页面前部）
+WEB_HOST_RATE = 2.0                  # 每个主机的搜索请求速率（令牌桶，次/秒），命中响应缓存的请求不计；不同主机互不等待
+WEB_HOST_BURST = 8                   # 每个主机允许的突发请求数（令牌桶容量），偶发的并发查询无需等待
+SIMHASH_SHINGLE_SIZE = 3             # 近重复检测的词 shingle 长度
+SIMHASH_MAX_DISTANCE = 3             # SimHash 汉明距离不超过该值视为重复文档
+SIMHASH_CACHE_SIZE = 4096            # 缓存的文档签名数（知识库片段每次混合检索都会重复出现）
+
+# 🌐 Gradio 并发
+GRADIO_CONCURRENCY_LIMIT = 8         # 每个事件同时处理的请求数（与 OLLAMA_NUM_PARALLEL 对应）
+STREAM_UPDATE_INTERVAL = 0.05        # 流式输出时页面刷新的最小间隔（秒），即最多 20 次/秒
+
 # 📝 Prompt 模板
-QA_PROMPT = """你是一个英语学习助手。
+# 固定的系统提示放在最前面（系统提示 → 检索文档 → 问题），
+# 每次请求的前缀完全一致，Ollama 可直接复用已计算的KV缓存
+SYSTEM_PROMPT = """你是一个英语学习助手。
 请根据提供的文档回答用户的问题。
 要求：
 1. 然后给出相关的原文英文示例
 2. 如果问题与文档不相关，礼貌提示"抱歉，我无法回答此问题"。
-3. 回答时尽量详细易懂。
+3. 回答时尽量详细易懂。"""
 
-参考文档：
+USER_TEMPLATE = """参考文档：
 {context}
 
 问题：{query}"""
+
+# ⚡ 语义缓存
+SEMANTIC_CACHE_THRESHOLD = 0.92      # 余弦相似度阈值，超过即直接返回缓存回答
+SEMANTIC_CACHE_MAX_SIZE = 256        # 最多缓存的问答条数（超出按LRU淘汰）
+SEMANTIC_CACHE_TTL = 24 * 3600       # 缓存有效期（秒），None 表示永不过期
+SEMANTIC_CACHE_DIR = os.path.join(os.path.dirname(__file__), "semantic_cache")
+MEMORY_CACHE_THRESHOLD = 0.95        # 记忆应用更保守：只有几乎相同的问题才复用回答
+MEMORY_CACHE_MAX_SIZE = 500
+RETRIEVAL_CACHE_THRESHOLD = 0.9      # 检索结果缓存：相似查询直接复用检索到的文档
+RETRIEVAL_CACHE_MAX_SIZE = 256
+HYBRID_CACHE_THRESHOLD = 0.92        # 混合检索结果缓存（含网络结果）：近似重复的查询直接复用文档
+HYBRID_CACHE_MAX_SIZE = 256
+HYBRID_CACHE_TTL = 3600              # 网络内容会更新，缓存有效期比问答缓存短（秒）
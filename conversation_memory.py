@@ -1,10 +1,100 @@
 # conversation_memory.py - 上下文记忆功能模块
 
 from typing import List, Dict, Any, Optional
+from collections import Counter
 from dataclasses import dataclass, field
 from datetime import datetime
+import atexit
 import json
 import os
+import queue
+import re
+import sqlite3
+import threading
+
+import faiss
+import numpy as np
+
+from clients import EMBEDDINGS
+from config import MEMORY_FAISS_MIN_HISTORY, MEMORY_SEARCH_K, MEMORY_RECENCY_WEIGHT
+from json_utils import dumps, dumps_pretty, loads
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+# 语法术语表（用于关键词提取）
+ENGLISH_GRAMMAR_TERMS = [
+    "present perfect", "past tense", "future tense", "conditionals",
+    "articles", "prepositions", "conjunctions", "verbs", "nouns",
+    "adjectives", "adverbs", "pronouns", "tense", "aspect",
+    "grammar", "syntax", "clause", "phrase", "sentence"
+]
+
+CHINESE_GRAMMAR_TERMS = [
+    "现在完成时", "过去时", "将来时", "虚拟语气",
+    "冠词", "介词", "连词", "动词", "名词",
+    "形容词", "副词", "代词", "时态", "体态",
+    "语法", "句法", "从句", "短语", "句子"
+]
+
+# 对话摘要使用的主题（按优先级）
+MAIN_TOPICS = ("时态", "语法", "冠词", "虚拟语气", "条件句", "从句")
+
+
+def _build_keyword_matcher():
+    """
+    将全部术语编译为一个多模式匹配器，一次扫描文本即可找出所有术语
+
+    优先使用 Aho-Corasick 自动机（pyahocorasick），未安装时退化为预编译正则：
+    零宽先行断言让每个位置都尝试匹配，从而保留 "past tense" 与 "tense" 这类重叠命中
+    返回按首次出现顺序去重的术语（dict 保序），展示时截取前几个结果是确定的
+    """
+    terms = ENGLISH_GRAMMAR_TERMS + CHINESE_GRAMMAR_TERMS
+
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for term in terms:
+            automaton.add_word(term.lower(), term)
+        automaton.make_automaton()
+        return lambda text: dict.fromkeys(term for _, term in automaton.iter(text))
+
+    lookup = {term.lower(): term for term in terms}
+    # 长的术语优先，同一位置取最长匹配
+    pattern = re.compile("(?=(" + "|".join(map(re.escape, sorted(lookup, key=len, reverse=True))) + "))")
+    return lambda text: dict.fromkeys(lookup[m.group(1)] for m in pattern.finditer(text))
+
+
+_match_keywords = _build_keyword_matcher()
+
+
+# SQLite 存储：每轮对话一行，id 自增，只保留最近 max_history 行
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    ts TEXT NOT NULL,
+    session TEXT NOT NULL,
+    user TEXT NOT NULL,
+    ai TEXT NOT NULL,
+    metadata TEXT,
+    retrieved_docs TEXT,
+    context_summary TEXT,
+    keywords TEXT,
+    embedding BLOB
+)"""
+_INSERT_SQL = ("INSERT INTO turns (ts, session, user, ai, metadata, retrieved_docs, context_summary, keywords, embedding) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+_SELECT_RECENT_SQL = ("SELECT ts, session, user, ai, metadata, retrieved_docs, context_summary, keywords, embedding "
+                      "FROM turns ORDER BY id DESC LIMIT ?")
+# id 连续递增，按主键范围删除最旧的行
+_TRIM_SQL = "DELETE FROM turns WHERE id <= (SELECT max(id) FROM turns) - ?"
+
+
+# 后台写入线程的控制信号
+_TRUNCATE = object()
+_STOP = object()
 
 
 @dataclass
@@ -18,6 +108,13 @@ class ConversationTurn:
     retrieved_docs: List[str] = field(default_factory=list)
     context_summary: str = ""
     keywords: List[str] = field(default_factory=list)
+    # 关键词集合（构造时生成一次，相关性计算时直接求交集）
+    keyword_set: frozenset = field(init=False, repr=False, compare=False)
+    # 用户问题的归一化向量（语义相关性计算，只计算一次）
+    embedding: Optional[np.ndarray] = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.keyword_set = frozenset(self.keywords)
 
 
 class ConversationMemory:
@@ -26,15 +123,48 @@ class ConversationMemory:
     def __init__(self,
                  max_history: int = 10,
                  max_context_length: int = 2000,
-                 memory_file: str = "conversation_history.json"):
+                 memory_file: str = "conversation_history.db",
+                 embeddings=EMBEDDINGS):
         self.max_history = max_history
         self.max_context_length = max_context_length
         self.memory_file = memory_file
+        self.embeddings = embeddings  # 为 None 时只按关键词计算相关性
         self.conversation_history: List[ConversationTurn] = []
         self.current_session_id = self._generate_session_id()
 
-        # 加载历史记录
+        # 最近一次查询的关键词（同一轮对话中多次获取上下文时不重复提取）
+        self._last_query: Optional[str] = None
+        self._last_query_keywords: frozenset = frozenset()
+
+        # 最近一次查询的向量（获取上下文与保存本轮对话共用）
+        self._last_vector_query: Optional[str] = None
+        self._last_query_vector: Optional[np.ndarray] = None
+
+        # 历史问题向量环形缓冲区 (max_history, D)：新对话覆盖最旧的一行，不重新分配内存
+        self._emb_ring: Optional[np.ndarray] = None
+        self._write_idx = 0          # 累计写入行数，下一行写到 _write_idx % max_history
+        # 历史很长时改用 FAISS 内积索引（第 i 行对应第 i 轮对话）
+        self._use_faiss = max_history > MEMORY_FAISS_MIN_HISTORY
+        self._history_index: Optional[faiss.IndexFlatIP] = None
+        self._vectors_synced = False # 缓冲区/索引是否与 conversation_history 一致
+
+        # 统计信息随对话增删累加，刷新统计面板时无需遍历历史
+        self._topic_counter: Counter = Counter()
+        self._response_length_sum = 0
+        self._session_turns = 0
+
+        # 加载历史记录，并一次批量请求补齐历史问题的向量
         self._load_history()
+        for turn in self.conversation_history:
+            self._tally_turn(turn)
+        if self.embeddings is not None:
+            self._sync_history_vectors()
+
+        # 后台写入线程：对话记录入队后立即返回，磁盘写入不阻塞回答
+        self._write_queue: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
 
     def _generate_session_id(self) -> str:
         """生成会话ID"""
@@ -54,27 +184,60 @@ class ConversationMemory:
             metadata=metadata or {},
             retrieved_docs=retrieved_docs or [],
             keywords=self._extract_keywords(user_query + " " + ai_response),
-            context_summary=self._generate_summary(user_query, ai_response)
+            context_summary=self._generate_summary(user_query, ai_response),
+            embedding=self._get_query_vector(user_query) if self.embeddings is not None else None
         )
 
         self.conversation_history.append(turn)
+        if self._vectors_synced and turn.embedding is not None:
+            if self._use_faiss:
+                self._history_index.add(turn.embedding[None, :])
+            else:
+                self._emb_ring[self._write_idx % self.max_history] = turn.embedding
+                self._write_idx += 1
+        else:
+            self._vectors_synced = False
+
+        self._tally_turn(turn)
 
         # 限制历史记录长度
         if len(self.conversation_history) > self.max_history:
+            num_evicted = len(self.conversation_history) - self.max_history
+            for evicted in self.conversation_history[:num_evicted]:
+                self._tally_turn(evicted, -1)
+            if self._use_faiss and self._vectors_synced:
+                self._history_index.remove_ids(np.arange(num_evicted, dtype=np.int64))
             self.conversation_history = self.conversation_history[-self.max_history:]
 
-        # 保存到文件
-        self._save_history()
+        # 追加到文件
+        self._append_turn(turn)
 
-    def get_context_for_query(self, current_query: str, max_length: int = None) -> str:
-        """为当前查询获取上下文"""
+    def _tally_turn(self, turn: ConversationTurn, sign: int = 1) -> None:
+        """累加（sign=1）或扣除（sign=-1）单轮对话对统计信息的贡献"""
+        if sign > 0:
+            self._topic_counter.update(turn.keywords)
+        else:
+            self._topic_counter.subtract(turn.keywords)
+            for keyword in turn.keywords:
+                if self._topic_counter[keyword] <= 0:
+                    del self._topic_counter[keyword]
+        self._response_length_sum += sign * len(turn.ai_response)
+        if turn.session_id == self.current_session_id:
+            self._session_turns += sign
+
+    def get_context_for_query(self,
+                              current_query: str,
+                              max_length: int = None,
+                              current_keywords: Optional[frozenset] = None,
+                              query_vector: Optional[List[float]] = None) -> str:
+        """为当前查询获取上下文（current_keywords/query_vector 为已计算的查询关键词/向量，可选）"""
         if not self.conversation_history:
             return ""
 
         max_length = max_length or self.max_context_length
 
         # 获取相关的历史对话
-        relevant_contexts = self._get_relevant_context(current_query)
+        relevant_contexts = self._get_relevant_context(current_query, current_keywords, query_vector)
 
         # 构建上下文字符串
         context_parts = []
@@ -95,21 +258,57 @@ class ConversationMemory:
         context_header = f"📝 **对话历史 (最近{len(context_parts)}轮):**\n\n"
         return context_header + "\n\n".join(context_parts)
 
-    def _get_relevant_context(self, current_query: str) -> List[ConversationTurn]:
-        """获取与当前查询相关的上下文"""
+    def _rank_by_similarity(self, ids: np.ndarray, scores: np.ndarray) -> List[ConversationTurn]:
+        """候选轮次（下标 ids、相似度 scores）按相似度 + 时间加权排序，最近一轮固定排在最前"""
+        last = len(self.conversation_history) - 1
+        scores = scores + MEMORY_RECENCY_WEIGHT * (ids + 1) / len(self.conversation_history)
+
+        ranked = [last]
+        ranked.extend(int(ids[j]) for j in np.argsort(-scores, kind="stable") if ids[j] != last)
+        return [self.conversation_history[i] for i in ranked]
+
+    def _get_relevant_context(self,
+                              current_query: str,
+                              current_keywords: Optional[frozenset] = None,
+                              query_vector: Optional[List[float]] = None) -> List[ConversationTurn]:
+        """获取与当前查询相关的上下文（优先按语义相似度排序，向量不可用时按关键词重叠度）
+
+        最近一轮总是排在最前（"能再详细解释一下吗？"这类追问指的就是上一轮），
+        其余各轮按余弦相似度 + 时间加权排序
+        """
         if not self.conversation_history:
             return []
 
-        # 简单的相关性计算
-        current_keywords = set(self._extract_keywords(current_query))
+        # 语义相关性：历史很长时用 FAISS 索引取最相关的几轮，否则历史问题向量与查询向量一次矩阵乘法
+        q = self._get_query_vector(current_query, query_vector) if self.embeddings is not None else None
+        if q is not None and self._use_faiss:
+            if self._sync_history_vectors():
+                k = min(MEMORY_SEARCH_K, self._history_index.ntotal)
+                scores, ids = self._history_index.search(q[None, :], k)
+                valid = ids[0] >= 0
+                return self._rank_by_similarity(ids[0][valid], scores[0][valid])
+        elif q is not None:
+            ring = self._get_embedding_ring()
+            if ring is not None:
+                scores = ring @ q
+                # 环形缓冲区第 (start + i) % max_history 行对应第 i 轮对话
+                start = (self._write_idx - len(scores)) % self.max_history
+                scores = np.roll(scores, -start)
+                return self._rank_by_similarity(np.arange(len(scores)), scores)
+
+        # 关键词相关性计算
+        if current_keywords is None:
+            current_keywords = self._get_query_keywords(current_query)
+
+        num_turns = len(self.conversation_history)
+        recent_turns = self.conversation_history[-5:]  # 只考虑最近的5轮对话
+        start = num_turns - len(recent_turns)
 
         scored_turns = []
-        for turn in self.conversation_history[-5:]:  # 只考虑最近的5轮对话
-            turn_keywords = set(turn.keywords)
-
+        for idx, turn in enumerate(recent_turns):
             # 计算关键词重叠度
-            overlap = len(current_keywords & turn_keywords)
-            recency_score = len(self.conversation_history) - self.conversation_history.index(turn)
+            overlap = len(current_keywords & turn.keyword_set)
+            recency_score = num_turns - (start + idx)
 
             total_score = overlap * 2 + recency_score
             scored_turns.append((total_score, turn))
@@ -123,31 +322,77 @@ class ConversationMemory:
         time_str = turn.timestamp.strftime("%H:%M")
         return f"**[{time_str}] 用户:** {turn.user_query}\n**助手:** {turn.ai_response}"
 
+    def _embed(self, text: str, vector: Optional[List[float]] = None) -> Optional[np.ndarray]:
+        """向量化并做L2归一化（内积即余弦相似度），失败时返回 None"""
+        try:
+            if vector is None:
+                vector = self.embeddings.embed_query(text)
+            vector = np.asarray(vector, dtype=np.float32)
+            return vector / (np.linalg.norm(vector) or 1.0)
+        except Exception as e:
+            print(f"⚠️ 对话向量化失败，使用关键词匹配: {e}")
+            return None
+
+    def _get_query_vector(self, query: str, vector: Optional[List[float]] = None) -> Optional[np.ndarray]:
+        """查询向量（记住最近一次查询的结果，调用方已有向量时直接复用）"""
+        if vector is not None or query != self._last_vector_query:
+            self._last_vector_query = query
+            self._last_query_vector = self._embed(query, vector)
+        return self._last_query_vector
+
+    def _sync_history_vectors(self) -> bool:
+        """缺失的历史问题向量一次批量请求补算（缓存在对话轮次上），再重建环形缓冲区或FAISS索引"""
+        if self._vectors_synced:
+            return True
+        if not self.conversation_history:
+            return False
+
+        missing = [turn for turn in self.conversation_history if turn.embedding is None]
+        if missing:
+            try:
+                vectors = np.asarray(
+                    self.embeddings.embed_documents([turn.user_query for turn in missing]),
+                    dtype=np.float32
+                )
+            except Exception as e:
+                print(f"⚠️ 对话向量化失败，使用关键词匹配: {e}")
+                return False
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+            for turn, vector in zip(missing, vectors):
+                turn.embedding = vector
+
+        dim = len(self.conversation_history[0].embedding)
+        if self._use_faiss:
+            if self._history_index is None:
+                self._history_index = faiss.IndexFlatIP(dim)
+            self._history_index.reset()
+            self._history_index.add(np.stack([turn.embedding for turn in self.conversation_history]))
+        else:
+            if self._emb_ring is None:
+                self._emb_ring = np.zeros((self.max_history, dim), dtype=np.float32)
+            for i, turn in enumerate(self.conversation_history):
+                self._emb_ring[i] = turn.embedding
+            self._write_idx = len(self.conversation_history)
+
+        self._vectors_synced = True
+        return True
+
+    def _get_embedding_ring(self) -> Optional[np.ndarray]:
+        """历史问题向量（环形缓冲区已写入部分的视图）"""
+        if not self._sync_history_vectors():
+            return None
+        return self._emb_ring[:min(self._write_idx, self.max_history)]
+
+    def _get_query_keywords(self, query: str) -> frozenset:
+        """提取查询关键词（记住最近一次查询的结果）"""
+        if query != self._last_query:
+            self._last_query = query
+            self._last_query_keywords = frozenset(self._extract_keywords(query))
+        return self._last_query_keywords
+
     def _extract_keywords(self, text: str) -> List[str]:
-        """提取关键词"""
-        # 简单的关键词提取（可以替换为更复杂的NLP方法）
-        english_grammar_terms = [
-            "present perfect", "past tense", "future tense", "conditionals",
-            "articles", "prepositions", "conjunctions", "verbs", "nouns",
-            "adjectives", "adverbs", "pronouns", "tense", "aspect",
-            "grammar", "syntax", "clause", "phrase", "sentence"
-        ]
-
-        chinese_grammar_terms = [
-            "现在完成时", "过去时", "将来时", "虚拟语气",
-            "冠词", "介词", "连词", "动词", "名词",
-            "形容词", "副词", "代词", "时态", "体态",
-            "语法", "句法", "从句", "短语", "句子"
-        ]
-
-        text_lower = text.lower()
-        keywords = []
-
-        for term in english_grammar_terms + chinese_grammar_terms:
-            if term.lower() in text_lower:
-                keywords.append(term)
-
-        return list(set(keywords))  # 去重
+        """提取关键词（单次扫描匹配全部语法术语，可以替换为更复杂的NLP方法）"""
+        return list(_match_keywords(text.lower()))
 
     def _generate_summary(self, user_query: str, ai_response: str) -> str:
         """生成对话摘要"""
@@ -155,70 +400,170 @@ class ConversationMemory:
         return f"用户询问了关于{self._extract_main_topic(user_query)}的问题"
 
     def _extract_main_topic(self, text: str) -> str:
-        """提取主要主题"""
-        topics = ["时态", "语法", "冠词", "虚拟语气", "条件句", "从句"]
-        text_lower = text.lower()
-
-        for topic in topics:
-            if topic in text_lower:
+        """提取主要主题（主题均为中文，无需转小写）"""
+        for topic in MAIN_TOPICS:
+            if topic in text:
                 return topic
 
         return "英语语法"
 
+    @staticmethod
+    def _turn_to_row(turn: ConversationTurn) -> tuple:
+        """对话轮次 → 数据库行（问题向量以 float32 字节保存，加载后无需重新向量化）"""
+        return (
+            turn.timestamp.isoformat(),
+            turn.session_id,
+            turn.user_query,
+            turn.ai_response,
+            dumps(turn.metadata),
+            dumps(turn.retrieved_docs),
+            turn.context_summary,
+            dumps(turn.keywords),
+            turn.embedding.astype(np.float32).tobytes() if turn.embedding is not None else None
+        )
+
+    @staticmethod
+    def _turn_from_row(row: tuple) -> ConversationTurn:
+        """数据库行 → 对话轮次"""
+        ts, session_id, user_query, ai_response, metadata, retrieved_docs, context_summary, keywords, embedding = row
+        return ConversationTurn(
+            user_query=user_query,
+            ai_response=ai_response,
+            timestamp=datetime.fromisoformat(ts),
+            session_id=session_id,
+            metadata=loads(metadata) if metadata else {},
+            retrieved_docs=loads(retrieved_docs) if retrieved_docs else [],
+            context_summary=context_summary or "",
+            keywords=loads(keywords) if keywords else [],
+            embedding=np.frombuffer(embedding, dtype=np.float32).copy() if embedding else None
+        )
+
+    @staticmethod
+    def _turn_from_dict(turn_dict: Dict[str, Any]) -> ConversationTurn:
+        """字典 → 对话轮次（读取旧版 JSON/JSONL 历史文件）"""
+        return ConversationTurn(
+            user_query=turn_dict["user_query"],
+            ai_response=turn_dict["ai_response"],
+            timestamp=datetime.fromisoformat(turn_dict["timestamp"]),
+            session_id=turn_dict["session_id"],
+            metadata=turn_dict.get("metadata", {}),
+            retrieved_docs=turn_dict.get("retrieved_docs", []),
+            context_summary=turn_dict.get("context_summary", ""),
+            keywords=turn_dict.get("keywords", [])
+        )
+
+    def _append_turn(self, turn: ConversationTurn) -> None:
+        """将一轮对话交给后台线程追加写入"""
+        self._write_queue.put(turn)
+
+    def _connect(self) -> sqlite3.Connection:
+        """打开历史数据库（WAL 模式：写入崩溃安全，读写互不阻塞）"""
+        conn = sqlite3.connect(self.memory_file)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_CREATE_TABLE_SQL)
+        return conn
+
+    def _writer_loop(self) -> None:
+        """后台写入：持有一个数据库连接，每轮对话一个事务（插入新行并删除超出 max_history 的旧行）"""
+        conn = None
+        while True:
+            item = self._write_queue.get()
+            try:
+                if item is _STOP:
+                    break
+                if conn is None:
+                    conn = self._connect()
+                with conn:
+                    if item is _TRUNCATE:
+                        conn.execute("DELETE FROM turns")
+                    else:
+                        conn.execute(_INSERT_SQL, self._turn_to_row(item))
+                        conn.execute(_TRIM_SQL, (self.max_history,))
+            except Exception as e:
+                print(f"保存对话历史失败: {e}")
+            finally:
+                self._write_queue.task_done()
+
+        if conn is not None:
+            conn.close()
+
+    def flush(self) -> None:
+        """等待所有排队的写入完成"""
+        if self._writer.is_alive():
+            self._write_queue.join()
+
+    def close(self) -> None:
+        """写完剩余记录后停止后台线程"""
+        if self._writer.is_alive():
+            self._write_queue.put(_STOP)
+            self._writer.join()
+
     def _save_history(self) -> None:
-        """保存历史记录到文件"""
+        """将当前历史记录整体写入数据库（仅在迁移旧版历史文件时使用）"""
         try:
-            history_data = []
-            for turn in self.conversation_history:
-                turn_dict = {
-                    "user_query": turn.user_query,
-                    "ai_response": turn.ai_response,
-                    "timestamp": turn.timestamp.isoformat(),
-                    "session_id": turn.session_id,
-                    "metadata": turn.metadata,
-                    "retrieved_docs": turn.retrieved_docs,
-                    "context_summary": turn.context_summary,
-                    "keywords": turn.keywords
-                }
-                history_data.append(turn_dict)
-
-            with open(self.memory_file, "w", encoding="utf-8") as f:
-                json.dump(history_data, f, ensure_ascii=False, indent=2)
-
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(_INSERT_SQL, [self._turn_to_row(turn) for turn in self.conversation_history])
+            finally:
+                conn.close()
         except Exception as e:
             print(f"保存对话历史失败: {e}")
 
     def _load_history(self) -> None:
-        """从文件加载历史记录"""
+        """从数据库加载最近 max_history 轮对话"""
         try:
-            if os.path.exists(self.memory_file):
-                with open(self.memory_file, "r", encoding="utf-8") as f:
-                    history_data = json.load(f)
-
-                for turn_dict in history_data[-self.max_history:]:  # 只加载最近的记录
-                    turn = ConversationTurn(
-                        user_query=turn_dict["user_query"],
-                        ai_response=turn_dict["ai_response"],
-                        timestamp=datetime.fromisoformat(turn_dict["timestamp"]),
-                        session_id=turn_dict["session_id"],
-                        metadata=turn_dict.get("metadata", {}),
-                        retrieved_docs=turn_dict.get("retrieved_docs", []),
-                        context_summary=turn_dict.get("context_summary", ""),
-                        keywords=turn_dict.get("keywords", [])
-                    )
-                    self.conversation_history.append(turn)
+            if not os.path.exists(self.memory_file):
+                self._migrate_legacy_history()
+                return
+
+            conn = self._connect()
+            try:
+                rows = conn.execute(_SELECT_RECENT_SQL, (self.max_history,)).fetchall()
+                # max_history 调小后删除多余的旧记录
+                with conn:
+                    conn.execute(_TRIM_SQL, (self.max_history,))
+            finally:
+                conn.close()
+
+            self.conversation_history = [self._turn_from_row(row) for row in reversed(rows)]
 
         except Exception as e:
             print(f"加载对话历史失败: {e}")
 
+    def _migrate_legacy_history(self) -> None:
+        """兼容旧版历史文件（JSONL 或 JSON 数组），导入数据库"""
+        base = os.path.splitext(self.memory_file)[0]
+        for legacy_file in (base + ".jsonl", base + ".json"):
+            if legacy_file == self.memory_file or not os.path.exists(legacy_file):
+                continue
+
+            with open(legacy_file, "rb") as f:
+                if legacy_file.endswith(".jsonl"):
+                    history_data = [loads(line) for line in f if line.strip()]
+                else:
+                    history_data = loads(f.read())
+
+            # 只加载最近的记录
+            self.conversation_history = [self._turn_from_dict(d) for d in history_data[-self.max_history:]]
+            self._save_history()
+            return
+
     def clear_history(self) -> None:
         """清空历史记录"""
         self.conversation_history.clear()
+        self._topic_counter.clear()
+        self._response_length_sum = 0
+        self._session_turns = 0
+        self._write_idx = 0
+        if self._history_index is not None:
+            self._history_index.reset()
+        self._vectors_synced = self._emb_ring is not None or self._history_index is not None
         self.current_session_id = self._generate_session_id()
 
-        # 删除历史文件
-        if os.path.exists(self.memory_file):
-            os.remove(self.memory_file)
+        # 清空数据库（由后台线程执行，保证与之前排队的写入顺序一致）
+        self._write_queue.put(_TRUNCATE)
 
     def get_conversation_stats(self) -> Dict[str, Any]:
         """获取对话统计信息"""
@@ -230,30 +575,14 @@ class ConversationMemory:
                 "avg_response_length": 0
             }
 
-        # 统计信息
+        # 统计信息（话题计数、回答总长度在增删对话时已累加）
         total_conversations = len(self.conversation_history)
-        current_session_conversations = len([
-            turn for turn in self.conversation_history
-            if turn.session_id == self.current_session_id
-        ])
-
-        # 统计话题
-        all_keywords = []
-        for turn in self.conversation_history:
-            all_keywords.extend(turn.keywords)
-
-        topic_counts = {}
-        for keyword in all_keywords:
-            topic_counts[keyword] = topic_counts.get(keyword, 0) + 1
-
-        most_discussed = sorted(topic_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-
-        # 平均回答长度
-        avg_response_length = sum(len(turn.ai_response) for turn in self.conversation_history) / len(self.conversation_history)
+        most_discussed = self._topic_counter.most_common(5)
+        avg_response_length = self._response_length_sum / total_conversations
 
         return {
             "total_conversations": total_conversations,
-            "current_session_length": current_session_conversations,
+            "current_session_length": self._session_turns,
             "most_discussed_topics": [{"topic": topic, "count": count} for topic, count in most_discussed],
             "avg_response_length": round(avg_response_length, 1)
         }
@@ -272,14 +601,14 @@ class ConversationMemory:
         export_data = []
         for turn in self.conversation_history:
             export_data.append({
-                "timestamp": turn.timestamp.isoformat(),
+                "timestamp": turn.timestamp,
                 "user": turn.user_query,
                 "assistant": turn.ai_response,
                 "session": turn.session_id,
                 "keywords": turn.keywords
             })
 
-        return json.dumps(export_data, ensure_ascii=False, indent=2)
+        return dumps_pretty(export_data).decode("utf-8")
 
     def _export_as_text(self) -> str:
         """导出为文本格式"""
@@ -319,6 +648,7 @@ def reset_conversation_memory():
     global _global_memory
     if _global_memory:
         _global_memory.clear_history()
+        _global_memory.close()
     _global_memory = ConversationMemory()
 
 
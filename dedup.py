@@ -0,0 +1,98 @@
+# dedup.py - 基于 SimHash 的近重复文档检测
+
+import hashlib
+import re
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import SIMHASH_MAX_DISTANCE, SIMHASH_SHINGLE_SIZE, SIMHASH_CACHE_SIZE
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# 64位签名切成4段，每段16位
+_NUM_BANDS = 4
+_BAND_BITS = 64 // _NUM_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+# shingle 的64位哈希：xxh3 比 blake2b 快一个数量级，签名只在进程内比较，两者不会混用
+if xxhash is not None:
+    _hash64 = xxhash.xxh3_64_digest
+else:
+    def _hash64(data: bytes) -> bytes:
+        return hashlib.blake2b(data, digest_size=8).digest()
+
+
+@lru_cache(maxsize=SIMHASH_CACHE_SIZE)
+def simhash(text: str, shingle_size: int = SIMHASH_SHINGLE_SIZE) -> int:
+    """计算文本的64位 SimHash 签名（按词 shingle 哈希后逐位加权投票）
+
+    结果按文本缓存：同一知识库片段在多次检索中只计算一次签名
+    """
+    tokens = _TOKEN_RE.findall(text.lower())
+    if len(tokens) > shingle_size:
+        shingles = [" ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)]
+    else:
+        shingles = [" ".join(tokens)]
+
+    # 每个 shingle 一个64位哈希，展开成 (n, 64) 的比特矩阵
+    digests = b"".join(_hash64(s.encode("utf-8")) for s in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+
+    # 多数投票：某一位为1的 shingle 超过一半则签名该位为1
+    votes = bits.sum(axis=0, dtype=np.int32) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(votes, bitorder="little").tobytes(), "little")
+
+
+def content_hash(text: str) -> bytes:
+    """规范化全文（去首尾空白、小写）的128位哈希，完全相同的文档无需再比较签名"""
+    data = text.strip().lower().encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(data)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个签名的汉明距离（int.bit_count 使用CPU的 popcnt 指令）"""
+    return (a ^ b).bit_count()
+
+
+class SimHashDeduper:
+    """
+    近重复检测：签名汉明距离 ≤ max_distance 即视为重复
+
+    签名按16位分成4段建立倒排，距离 ≤ 3 的两个签名至少有一段完全相同（鸽巢原理），
+    只需与同段的候选比较，无需两两比较全部文档
+    """
+
+    def __init__(self, max_distance: int = SIMHASH_MAX_DISTANCE):
+        if max_distance >= _NUM_BANDS:
+            raise ValueError(f"max_distance 需小于分段数 {_NUM_BANDS}")
+        self.max_distance = max_distance
+        self._bands: List[Dict[int, List[int]]] = [{} for _ in range(_NUM_BANDS)]
+
+    @staticmethod
+    def _band_keys(signature: int) -> Tuple[int, ...]:
+        return tuple((signature >> (i * _BAND_BITS)) & _BAND_MASK for i in range(_NUM_BANDS))
+
+    def is_duplicate(self, signature: int) -> bool:
+        """是否与已加入的签名近重复"""
+        for band, key in zip(self._bands, self._band_keys(signature)):
+            for candidate in band.get(key, ()):
+                if hamming_distance(signature, candidate) <= self.max_distance:
+                    return True
+        return False
+
+    def add(self, signature: int) -> bool:
+        """加入签名；已存在近重复时不加入并返回 False"""
+        if self.is_duplicate(signature):
+            return False
+        for band, key in zip(self._bands, self._band_keys(signature)):
+            band.setdefault(key, []).append(signature)
+        return True
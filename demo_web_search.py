@@ -2,7 +2,7 @@
 
 from web_search_integration import DuckDuckGoSearchEngine, WikipediaSearchEngine, HybridRAGSystem
 from retriever_enhanced import EnhancedRetriever
-import json
+from json_utils import dump_file
 import time
 
 
@@ -79,13 +79,13 @@ def test_hybrid_system():
         print("-" * 40)
 
         try:
-            start_time = time.time()
+            start_ns = time.perf_counter_ns()
             docs = hybrid_system.search_and_retrieve(
                 query,
                 use_local=local_retriever is not None,
                 use_web=True
             )
-            search_time = time.time() - start_time
+            search_time = (time.perf_counter_ns() - start_ns) / 1e9
 
             print(f"⏱️  搜索耗时: {search_time:.2f}秒")
             print(f"📊 检索文档数: {len(docs)}")
@@ -162,8 +162,7 @@ def save_test_results():
     }
 
     # 保存到文件
-    with open("web_search_test_results.json", "w", encoding="utf-8") as f:
-        json.dump(test_data, f, ensure_ascii=False, indent=2)
+    dump_file(test_data, "web_search_test_results.json")
 
     print("✅ 测试结果已保存到 web_search_test_results.json")
 
@@ -0,0 +1,309 @@
+# faiss_store.py - 向量数据库加载与检索工具
+
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+import faiss
+import numpy as np
+import os
+from typing import List, Optional, Sequence
+from config import (DB_DIR, FAISS_NUM_THREADS, FAISS_ANN_INDEX, IVF_NLIST, IVF_NPROBE,
+                    PQ_M, PQ_NBITS, REFINE_K_FACTOR, HNSW_M, HNSW_EF_SEARCH, ANN_AUTO_BUILD_MIN,
+                    FAISS_USE_GPU, FAISS_GPU_DEVICE, FAISS_MMAP)
+
+# FAISS 的 BLAS/OpenMP 路径按CPU核数并行
+faiss.omp_set_num_threads(FAISS_NUM_THREADS)
+
+# 只读内存映射：索引数据留在OS页缓存中按需读入，多进程共享同一份物理内存
+# IO_FLAG_MMAP 映射IVF倒排表，IO_FLAG_MMAP_IFC 映射平坦/SQ/HNSW等定长编码（旧版faiss没有），两者不能同时使用
+_MMAP_IVF_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+_MMAP_CODES_FLAGS = (faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY) if hasattr(faiss, "IO_FLAG_MMAP_IFC") else 0
+
+
+def _io_flags(index_type: str) -> int:
+    """按索引类型选择读取标志"""
+    if not FAISS_MMAP:
+        return 0
+    return _MMAP_IVF_FLAGS if index_type.startswith("ivf") else _MMAP_CODES_FLAGS
+
+# GPU 资源需在索引整个生命周期内保持存活
+_gpu_resources = None
+
+# 向量统一做L2归一化，使用内积检索（内积即余弦相似度）
+VECTOR_STORE_KWARGS = {
+    "distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT,
+    "normalize_L2": True,
+}
+
+
+def to_inner_product_index(index: faiss.Index) -> faiss.IndexFlatIP:
+    """将旧的L2索引转换为归一化向量上的 IndexFlatIP"""
+    vectors = index.reconstruct_n(0, index.ntotal)
+    faiss.normalize_L2(vectors)
+
+    ip_index = faiss.IndexFlatIP(index.d)
+    ip_index.add(vectors)
+    return ip_index
+
+
+def ann_index_path(vector_store_path: str = DB_DIR, index_type: str = FAISS_ANN_INDEX) -> str:
+    """近似索引文件路径，与 index.faiss 存放在同一目录"""
+    return os.path.join(vector_store_path, f"{index_type}.index")
+
+
+def build_ann_index(index: faiss.Index, index_type: str = FAISS_ANN_INDEX) -> Optional[faiss.Index]:
+    """
+    由平坦索引构建近似/压缩索引，向量顺序不变，index_to_docstore_id 可直接复用
+
+    Args:
+        index: 归一化向量上的平坦索引
+        index_type: ivfpq / ivfsq8 / sq8 / pqrefine / hnsw
+
+    Returns:
+        近似索引；向量数不足以训练时返回 None（继续使用平坦索引）
+    """
+    xb = index.reconstruct_n(0, index.ntotal)
+    faiss.normalize_L2(xb)
+    d = index.d
+
+    if index_type in ("ivfpq", "ivfsq8"):
+        # k-means 每个聚类至少需要约39个训练样本，PQ码本需要 2^nbits 个
+        min_train = IVF_NLIST * 39
+        if index_type == "ivfpq":
+            min_train = max(min_train, 2 ** PQ_NBITS)
+        if index.ntotal < min_train:
+            print(f"⚠️ 向量数 {index.ntotal} 不足以训练 {index_type}（至少 {min_train}），继续使用平坦索引")
+            return None
+
+        quantizer = faiss.IndexFlatIP(d)
+        if index_type == "ivfpq":
+            if d % PQ_M != 0:
+                print(f"⚠️ 向量维度 {d} 不能被 PQ_M={PQ_M} 整除，继续使用平坦索引")
+                return None
+            ann_index = faiss.IndexIVFPQ(quantizer, d, IVF_NLIST, PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+        else:
+            ann_index = faiss.IndexIVFScalarQuantizer(
+                quantizer, d, IVF_NLIST, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+        ann_index.train(xb)
+    elif index_type == "sq8":
+        # 每维 int8 标量量化：内存和每次距离计算读取的字节数降为 float32 的 1/4，训练只需统计各维取值范围
+        ann_index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        ann_index.train(xb)
+    elif index_type == "pqrefine":
+        # PQ 编码（每向量 PQ_M 字节）粗排，候选再用原始向量精确重排
+        if index.ntotal < 2 ** PQ_NBITS or d % PQ_M != 0:
+            print(f"⚠️ 向量数 {index.ntotal} 或维度 {d} 不满足 PQ 训练要求，继续使用平坦索引")
+            return None
+        ann_index = faiss.IndexRefineFlat(faiss.IndexPQ(d, PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT))
+        ann_index.train(xb)
+    elif index_type == "hnsw":
+        ann_index = faiss.IndexHNSWFlat(d, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    else:
+        raise ValueError(f"不支持的索引类型: {index_type}")
+
+    ann_index.add(xb)
+    return ann_index
+
+
+def save_ann_index(db: FAISS, vector_store_path: str = DB_DIR,
+                   index_type: str = FAISS_ANN_INDEX) -> Optional[faiss.Index]:
+    """构建并保存近似索引，返回构建的索引；无法构建时删除旧文件，避免加载到与知识库不一致的索引"""
+    path = ann_index_path(vector_store_path, index_type)
+    ann_index = build_ann_index(db.index, index_type)
+
+    if ann_index is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+
+    faiss.write_index(ann_index, path)
+    print(f"✅ 已保存 {index_type} 近似索引: {path}")
+    return ann_index
+
+
+def ensure_ann_index(db: FAISS, vector_store_path: str = DB_DIR, min_vectors: int = ANN_AUTO_BUILD_MIN) -> bool:
+    """
+    已加载的仍是平坦索引（未离线构建或近似索引已过期）且向量数超过 min_vectors 时，
+    当场构建近似索引、持久化并替换 db.index，之后启动直接加载
+
+    Returns:
+        是否替换了索引
+    """
+    if (FAISS_ANN_INDEX == "flat" or not isinstance(db.index, faiss.IndexFlat)
+            or db.index.ntotal <= min_vectors):
+        return False
+
+    print(f"📚 知识库共 {db.index.ntotal} 个向量，自动构建 {FAISS_ANN_INDEX} 索引...")
+    ann_index = save_ann_index(db, vector_store_path)
+    if ann_index is None:
+        return False
+
+    db.index = to_gpu_index(_configure_ann_index(ann_index))
+    return True
+
+
+def _configure_ann_index(index: faiss.Index) -> faiss.Index:
+    """设置检索参数"""
+    if isinstance(index, faiss.IndexRefine):
+        index.k_factor = REFINE_K_FACTOR
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = IVF_NPROBE
+        # MMR 需要按id取回向量
+        ivf.make_direct_map()
+    return index
+
+
+def to_gpu_index(index: faiss.Index) -> faiss.Index:
+    """有可用GPU（faiss-gpu）时将索引复制到GPU，否则原样返回"""
+    global _gpu_resources
+
+    # faiss-cpu 没有 get_num_gpus / StandardGpuResources
+    if not FAISS_USE_GPU or not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return index
+
+    try:
+        if _gpu_resources is None:
+            _gpu_resources = faiss.StandardGpuResources()
+        gpu_index = faiss.index_cpu_to_gpu(_gpu_resources, FAISS_GPU_DEVICE, index)
+        print(f"🚀 FAISS 索引已加载到 GPU {FAISS_GPU_DEVICE}")
+        return gpu_index
+    except Exception as e:
+        # 如 HNSW 不支持GPU
+        print(f"⚠️ FAISS 索引无法放到GPU，使用CPU检索: {e}")
+        return index
+
+
+def _write_index_atomic(index: faiss.Index, path: str) -> None:
+    """先写临时文件再替换，其他进程已映射的旧文件不受影响"""
+    tmp_path = path + ".tmp"
+    try:
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"⚠️ 保存索引失败: {e}")
+
+
+def load_vector_store(embeddings, vector_store_path: str = DB_DIR, use_ann: bool = True) -> FAISS:
+    """加载向量数据库，并确保底层索引为归一化的内积索引；use_ann=False 时返回CPU上的平坦索引（用于离线构建）"""
+    db = FAISS.load_local(
+        vector_store_path,
+        embeddings,
+        allow_dangerous_deserialization=True,
+        io_flags=_io_flags("flat"),
+        **VECTOR_STORE_KWARGS
+    )
+
+    # 兼容旧版知识库：文档内容未在入库时去除首尾空白、未标记来源类型，加载时统一处理一次
+    for doc in db.docstore._dict.values():
+        doc.page_content = doc.page_content.strip()
+        doc.metadata.setdefault("source_type", "local")
+
+    # 优先使用离线构建的近似索引（见 build_ann_index.py）
+    path = ann_index_path(vector_store_path)
+    ann_loaded = False
+    if use_ann and FAISS_ANN_INDEX != "flat" and os.path.exists(path):
+        try:
+            ann_index = faiss.read_index(path, _io_flags(FAISS_ANN_INDEX))
+            if ann_index.ntotal == db.index.ntotal:
+                db.index = _configure_ann_index(ann_index)
+                ann_loaded = True
+            else:
+                print("⚠️ 近似索引与知识库不一致，请重新运行 build_ann_index.py")
+        except Exception as e:
+            print(f"⚠️ 加载近似索引失败，使用平坦索引: {e}")
+
+    # 兼容旧版知识库（IndexFlatL2 + 未归一化向量）；转换会把向量复制到堆内存，
+    # 只在实际使用平坦索引时进行，并写回 index.faiss，之后启动可直接内存映射
+    if not ann_loaded and db.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        db.index = to_inner_product_index(db.index)
+        _write_index_atomic(db.index, os.path.join(vector_store_path, "index.faiss"))
+
+    if use_ann:
+        db.index = to_gpu_index(db.index)
+    return db
+
+
+def search_by_vectors(db: FAISS, query_vectors: Sequence[Sequence[float]], k: int = 4) -> List[List[Document]]:
+    """
+    使用已计算好的查询向量批量检索（一次 index.search 完成所有查询）
+
+    Args:
+        db: 向量数据库
+        query_vectors: 查询向量列表
+        k: 每个查询返回的文档数
+
+    Returns:
+        与 query_vectors 一一对应的文档列表
+    """
+    vectors = np.array(query_vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    _, indices = db.index.search(vectors, k)
+
+    results = []
+    for row in indices:
+        docs = []
+        for i in row:
+            if i == -1:  # 文档数不足k个
+                continue
+            docs.append(db.docstore.search(db.index_to_docstore_id[i]))
+        results.append(docs)
+    return results
+
+
+def _stores_exact_vectors(index: faiss.Index) -> bool:
+    """索引是否保存原始（已归一化）向量：平坦、HNSW-Flat 和精排索引的 reconstruct 结果无损"""
+    return isinstance(index, (faiss.IndexFlat, faiss.IndexHNSWFlat, faiss.IndexRefine))
+
+
+def mmr_search_by_vector(db: FAISS,
+                         query_vector: Sequence[float],
+                         k: int = 4,
+                         fetch_k: int = 20,
+                         lambda_mult: float = 0.5) -> List[Document]:
+    """
+    最大边际相关性（MMR）检索：候选向量一次批量取回，与查询的相关度和候选两两相似度
+    各用一次矩阵乘法算好，贪心选择只做数组运算（结果与 LangChain 的 MMR 一致）
+
+    Args:
+        db: 向量数据库
+        query_vector: 查询向量
+        k: 返回的文档数
+        fetch_k: 参与MMR选择的候选数
+        lambda_mult: 相关性权重（0-1，越小越注重多样性）
+
+    Returns:
+        按选择顺序排列的文档列表
+    """
+    query = np.array([query_vector], dtype=np.float32)
+    faiss.normalize_L2(query)
+    scores, indices = db.index.search(query, fetch_k)
+    found = indices[0] != -1  # 文档数不足 fetch_k 个时有 -1
+    ids = indices[0][found]
+    if k <= 0 or len(ids) == 0:
+        return []
+
+    vectors = db.index.reconstruct_batch(ids)
+    if _stores_exact_vectors(db.index):
+        # 索引中存的就是归一化的原始向量，检索得分即余弦相似度
+        relevance = scores[0][found]
+    else:
+        # 量化索引取回的是近似向量，重新归一化后内积即余弦相似度
+        faiss.normalize_L2(vectors)
+        relevance = vectors @ query[0]
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    # 每个候选与已选文档的最大相似度，每选一个文档增量更新
+    redundancy = similarity[selected[0]].copy()
+    for _ in range(min(k, len(ids)) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(redundancy, similarity[best], out=redundancy)
+
+    return [db.docstore.search(db.index_to_docstore_id[ids[i]]) for i in selected]
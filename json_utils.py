@@ -0,0 +1,72 @@
+# json_utils.py - JSON 序列化工具（安装了 orjson 时使用 orjson）
+
+from datetime import datetime
+import json
+from typing import Any
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_default(obj):
+    """标准库 json 的兜底序列化（orjson 原生支持 datetime 和 numpy 标量）"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+def dumps(data: Any) -> str:
+    """序列化为紧凑的 JSON 文本"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, default=_json_default)
+
+
+def dumps_pretty(data: Any) -> bytes:
+    """带缩进的 UTF-8 JSON（用于导出和结果文件）"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, indent=2, default=_json_default).encode("utf-8")
+
+
+def dump_file(data: Any, path: str) -> None:
+    """以带缩进的 JSON 写入文件"""
+    with open(path, "wb") as f:
+        f.write(dumps_pretty(data))
+
+
+class JsonObjectWriter:
+    """逐项写入顶层 JSON 对象（与 dump_file 输出格式相同），无需先在内存中组装整个字典"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "wb")
+        self._file.write(b"{")
+        self._empty = True
+
+    def write(self, key: str, value: Any) -> None:
+        """写入一项并立即落盘"""
+        self._file.write(b"\n  " if self._empty else b",\n  ")
+        self._file.write(dumps(key).encode("utf-8") + b": ")
+        # 嵌套值整体再缩进一级（JSON 字符串内的换行已转义，直接替换安全）
+        self._file.write(dumps_pretty(value).replace(b"\n", b"\n  "))
+        self._file.flush()
+        self._empty = False
+
+    def close(self) -> None:
+        self._file.write(b"}" if self._empty else b"\n}")
+        self._file.close()
+
+    def __enter__(self) -> "JsonObjectWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+loads = orjson.loads if orjson is not None else json.loads
@@ -0,0 +1,76 @@
+# onnx_embeddings.py - 本地 ONNX Runtime 向量化（int8 动态量化，无需请求 Ollama）
+
+import asyncio
+import os
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import ONNX_EMBEDDING_MODEL, ONNX_MODEL_DIR, ONNX_MAX_LENGTH
+
+_QUANTIZED_FILE = "model_quantized.onnx"
+
+
+def _export_quantized_model(model_name: str, model_dir: str) -> None:
+    """首次使用时导出 ONNX 模型并做 int8 动态量化，保存到 model_dir（之后直接加载）"""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    print(f"📦 导出并量化 ONNX 向量化模型: {model_name}")
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    quantizer = ORTQuantizer.from_pretrained(model)
+    # 动态量化：权重 int8，激活在推理时量化，无需校准数据；avx512_vnni 配置在不支持的CPU上同样可用
+    quantizer.quantize(save_dir=model_dir,
+                       quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False))
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    sentence-transformers 模型的本地 ONNX Runtime 推理：均值池化 + L2 归一化
+
+    默认模型 all-MiniLM-L6-v2 与 Ollama 的 all-minilm 是同一模型，已有知识库无需重建
+    """
+
+    def __init__(self, model_name: str = ONNX_EMBEDDING_MODEL, model_dir: str = ONNX_MODEL_DIR):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        if not os.path.exists(os.path.join(model_dir, _QUANTIZED_FILE)):
+            _export_quantized_model(model_name, model_dir)
+
+        self.session = ort.InferenceSession(os.path.join(model_dir, _QUANTIZED_FILE),
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        # fast tokenizer 不支持多线程同时调用
+        self._tokenizer_lock = threading.Lock()
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        with self._tokenizer_lock:
+            encoded = self.tokenizer(texts, padding=True, truncation=True,
+                                     max_length=ONNX_MAX_LENGTH, return_tensors="np")
+
+        token_embeddings = self.session.run(None, {name: encoded[name] for name in self.input_names})[0]
+
+        # 均值池化（忽略 padding）后归一化
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        vectors = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._embed(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
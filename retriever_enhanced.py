@@ -1,13 +1,16 @@
 # retriever_enhanced.py - 增强的检索器系统
 
-from langchain_community.vectorstores import FAISS
-from langchain_ollama.llms import OllamaLLM
-from langchain_ollama.embeddings import OllamaEmbeddings
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-import numpy as np
-from typing import List, Dict, Any
-from config import DB_DIR, EMBEDDING_MODEL, LLM_MODEL
+from typing import List, Dict, Any, Optional
+from clients import EMBEDDINGS, LLM
+from faiss_store import load_vector_store, ensure_ann_index, search_by_vectors, mmr_search_by_vector
+from semantic_cache import SemanticCache
+from config import DB_DIR, RETRIEVAL_CACHE_THRESHOLD, RETRIEVAL_CACHE_MAX_SIZE
+
+# 增强检索参数
+ENHANCED_MAX_RESULTS = 5            # 最多返回的文档数
+ENHANCED_MIN_VECTOR_RESULTS = 3     # 向量检索结果少于该值时补充MMR结果
+DEDUP_PREFIX_LENGTH = 100           # 按前N个字符判断文档是否重复
 
 
 class EnhancedRetriever:
@@ -15,19 +18,30 @@ class EnhancedRetriever:
 
     def __init__(self, vector_store_path: str = DB_DIR):
         self.vector_store_path = vector_store_path
-        self.embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
-        self.llm = OllamaLLM(model=LLM_MODEL)
+        self.embeddings = EMBEDDINGS
+        self.llm = LLM
+
+        # 加载向量数据库（归一化向量 + 内积索引）
+        self.db = load_vector_store(self.embeddings, vector_store_path)
+        self._maybe_reindex()
 
-        # 加载向量数据库
-        self.db = FAISS.load_local(
-            vector_store_path,
+        # 检索结果缓存（仅内存）：相同/相似查询跳过检索
+        self.retrieval_cache = SemanticCache(
             self.embeddings,
-            allow_dangerous_deserialization=True
+            threshold=RETRIEVAL_CACHE_THRESHOLD,
+            max_size=RETRIEVAL_CACHE_MAX_SIZE
         )
 
         # 初始化检索器
         self._setup_retrievers()
 
+    def _maybe_reindex(self):
+        """大规模知识库尚无近似索引时自动构建，避免每次检索暴力扫描全部向量"""
+        try:
+            ensure_ann_index(self.db, self.vector_store_path)
+        except Exception as e:
+            print(f"⚠️ 自动构建近似索引失败，继续使用平坦索引: {e}")
+
     def _setup_retrievers(self):
         """设置多种检索器策略"""
 
@@ -56,6 +70,14 @@ class EnhancedRetriever:
         # 4. 上下文压缩检索器
         self._setup_compression_retriever()
 
+        # 检索方法名 → 检索器
+        self.retrievers = {
+            "vector": self.vector_retriever,
+            "mmr": self.mmr_retriever,
+            "ensemble": self.ensemble_retriever,
+            "compression": self.compression_retriever,
+        }
+
     def _setup_ensemble_retriever(self):
         """设置混合检索器（简化版本）"""
         try:
@@ -76,57 +98,97 @@ class EnhancedRetriever:
             print(f"⚠️ 压缩检索器设置失败: {e}")
             self.compression_retriever = self.vector_retriever
 
-    def get_relevant_documents(self, query: str, method: str = "enhanced") -> List[Document]:
+    def get_relevant_documents(self,
+                               query: str,
+                               method: str = "enhanced",
+                               query_vector: Optional[List[float]] = None) -> List[Document]:
         """
         根据查询检索相关文档
 
         Args:
             query: 用户查询
             method: 检索方法 ('vector', 'mmr', 'ensemble', 'compression', 'enhanced')
+            query_vector: 已计算好的查询向量（可选，避免重复向量化）
 
         Returns:
             检索到的相关文档列表
         """
-        if method == "vector":
-            return self.vector_retriever.invoke(query)
-        elif method == "mmr":
-            return self.mmr_retriever.invoke(query)
-        elif method == "ensemble":
-            return self.ensemble_retriever.invoke(query)
-        elif method == "compression":
-            return self.compression_retriever.invoke(query)
-        elif method == "enhanced":
+        if method != "enhanced" and method not in self.retrievers:
+            raise ValueError(f"未知的检索方法: {method}")
+
+        # 每个查询只向量化一次，各检索策略和检索结果缓存共用
+        if query_vector is None:
+            query_vector = self.embeddings.embed_query(query)
+
+        cached = self.retrieval_cache.get(query, namespace=method, vector=query_vector)
+        if cached is not None:
+            return list(cached["metadata"]["docs"])
+
+        if method == "enhanced":
             # 增强检索：结合多种方法
-            return self._enhanced_retrieval(query)
+            docs = self._enhanced_retrieval(query_vector)
         else:
+            docs = self._search_by_vector(self.retrievers[method], query_vector)
+
+        self.retrieval_cache.put(query, "", {"docs": docs}, namespace=method, vector=query_vector)
+        return list(docs)
+
+    def batch_get_relevant_documents(self,
+                                     queries: List[str],
+                                     method: str = "vector",
+                                     query_vectors: Optional[List[List[float]]] = None) -> List[List[Document]]:
+        """
+        批量检索：所有查询一次请求完成向量化，相似度检索一次 index.search 完成
+
+        Args:
+            queries: 查询列表
+            method: 检索方法（同 get_relevant_documents）
+            query_vectors: 已批量计算好的查询向量（可选，多种方法检索同一批查询时共用）
+
+        Returns:
+            与 queries 一一对应的文档列表
+        """
+        if method != "enhanced" and method not in self.retrievers:
             raise ValueError(f"未知的检索方法: {method}")
+        if not queries:
+            return []
 
-    def _enhanced_retrieval(self, query: str) -> List[Document]:
-        """增强检索：结合多种策略"""
-        results = []
+        if query_vectors is None:
+            query_vectors = self.embeddings.embed_documents(queries)
 
+        retriever = self.retrievers.get(method)
+        if retriever is not None and retriever.search_type == "similarity":
+            return search_by_vectors(self.db, query_vectors, retriever.search_kwargs["k"])
+
+        # MMR/增强检索需要逐个查询计算，仍复用批量得到的向量
+        return [self.get_relevant_documents(query, method, query_vector)
+                for query, query_vector in zip(queries, query_vectors)]
+
+    def _search_by_vector(self, retriever, query_vector: List[float]) -> List[Document]:
+        """按检索器的配置（search_type/search_kwargs）使用查询向量检索"""
+        if retriever.search_type == "mmr":
+            return mmr_search_by_vector(self.db, query_vector, **retriever.search_kwargs)
+        return self.db.similarity_search_by_vector(query_vector, **retriever.search_kwargs)
+
+    def _enhanced_retrieval(self, query_vector: List[float]) -> List[Document]:
+        """增强检索：结合多种策略"""
         # 1. 向量相似性检索
-        vector_docs = self.vector_retriever.invoke(query)
-        results.extend(vector_docs)
-
-        # 2. 如果向量检索结果不够，使用MMR
-        if len(vector_docs) < 3:
-            mmr_docs = self.mmr_retriever.invoke(query)
-            # 添加不重复的文档
-            for doc in mmr_docs:
-                if doc not in results and len(results) < 6:
-                    results.append(doc)
-
-        # 3. 去重并限制数量
+        results = self._search_by_vector(self.vector_retriever, query_vector)
+
+        # 2. 如果向量检索结果不够，补充MMR结果（重复的在下一步统一去掉）
+        if len(results) < ENHANCED_MIN_VECTOR_RESULTS:
+            results = results + self._search_by_vector(self.mmr_retriever, query_vector)
+
+        # 3. 去重并限制数量（一次集合查找，不再逐个比较 Document 对象）
         unique_docs = []
         seen_content = set()
 
         for doc in results:
-            content = doc.page_content[:100]  # 使用前100字符判断是否重复
+            content = doc.page_content[:DEDUP_PREFIX_LENGTH]
             if content not in seen_content:
                 seen_content.add(content)
                 unique_docs.append(doc)
-                if len(unique_docs) >= 5:  # 最多返回5个文档
+                if len(unique_docs) >= ENHANCED_MAX_RESULTS:
                     break
 
         return unique_docs
@@ -142,12 +204,12 @@ class EnhancedRetriever:
                 "recommendations": ["未检索到文档，请检查查询或知识库"]
             }
 
-        # 计算基本指标
-        content_lengths = [len(doc.page_content) for doc in docs]
-        avg_length = np.mean(content_lengths)
+        # 计算基本指标（文档只有几个，直接用内置函数；返回Python float，可直接JSON序列化）
+        contents = [doc.page_content for doc in docs]
+        avg_length = sum(map(len, contents)) / len(contents)
 
         # 简单的质量评分（基于内容长度和文档数量）
-        quality_score = min(100, (len(docs) * 20) + (avg_length / 20))
+        quality_score = min(100.0, len(docs) * 20.0 + avg_length / 20)
 
         # 生成建议
         recommendations = []
@@ -164,7 +226,7 @@ class EnhancedRetriever:
             "avg_content_length": avg_length,
             "quality_score": quality_score,
             "recommendations": recommendations,
-            "documents_preview": [{"content": doc.page_content[:100] + "..."} for doc in docs[:3]]
+            "documents_preview": [{"content": content[:100] + "..."} for content in contents[:3]]
         }
 
 
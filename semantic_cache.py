@@ -0,0 +1,217 @@
+# semantic_cache.py - 语义缓存模块
+
+import json
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from config import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_SIZE, SEMANTIC_CACHE_TTL
+
+# 连续的标点和空白（含中文标点）一次替换为单个空格
+_NORMALIZE_RE = re.compile(r"\W+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_query(query: str) -> str:
+    """规范化查询文本：小写、去标点、合并空白（只差标点/大小写的问题视为同一问题）
+
+    同一轮对话中语义缓存、向量缓存等各处使用同一查询，结果只计算一次
+    """
+    return _NORMALIZE_RE.sub(" ", query.lower()).strip()
+
+
+class SemanticCache:
+    """基于查询向量的语义缓存：相似问题直接返回已生成的回答，跳过检索和LLM生成"""
+
+    INDEX_FILE = "cache.index"
+    ENTRIES_FILE = "cache.json"
+
+    def __init__(self,
+                 embeddings,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_size: int = SEMANTIC_CACHE_MAX_SIZE,
+                 cache_dir: Optional[str] = None,
+                 ttl: Optional[float] = SEMANTIC_CACHE_TTL):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+        # 向量索引的第i行与 entries[i] 一一对应
+        self.index: Optional[faiss.IndexFlatIP] = None
+        self.entries: List[Dict[str, Any]] = []
+        # (命名空间, 规范化查询) → 条目，文本完全相同时无需向量检索
+        self._exact: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+
+        # 加载持久化的缓存
+        if cache_dir:
+            self.load()
+
+    def _embed(self, query: str, vector: Optional[Sequence[float]] = None) -> np.ndarray:
+        """向量化并做L2归一化（内积即余弦相似度），调用方已有查询向量时直接复用
+
+        各调用方都会传入已计算的查询向量；未传入时由向量化模型自身的查询缓存去重
+        """
+        if vector is None:
+            vector = self.embeddings.embed_query(query)
+
+        vector = np.array([vector], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return self.ttl is not None and now - entry["created"] > self.ttl
+
+    def _hit(self, entry: Dict[str, Any], score: float) -> Dict[str, Any]:
+        self._clock += 1
+        entry["last_used"] = self._clock
+        return {**entry, "score": score}
+
+    def _remove(self, i: int) -> None:
+        """删除第i条（IndexFlat 删除后会压缩后续行，与 list.pop 保持对齐）"""
+        self.index.remove_ids(np.array([i], dtype=np.int64))
+        entry = self.entries.pop(i)
+        key = (entry["namespace"], normalize_query(entry["query"]))
+        if self._exact.get(key) is entry:
+            del self._exact[key]
+
+    def get(self,
+            query: str,
+            namespace: str = "",
+            vector: Optional[Sequence[float]] = None) -> Optional[Dict[str, Any]]:
+        """
+        查找语义相似的已缓存问答
+
+        Args:
+            query: 用户查询
+            namespace: 缓存命名空间（不同检索模式的回答互不复用）
+            vector: 已计算好的查询向量（可选）
+
+        Returns:
+            命中的缓存条目（含 answer/metadata/score），未命中返回 None
+        """
+        if not self.entries:
+            return None
+
+        now = time.time()
+
+        # 规范化后文本相同，直接命中
+        with self._lock:
+            entry = self._exact.get((namespace, normalize_query(query)))
+            if entry is not None and not self._expired(entry, now):
+                return self._hit(entry, 1.0)
+
+        vector = self._embed(query, vector)
+
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return None
+
+            scores, ids = self.index.search(vector, self.index.ntotal)
+            for score, i in zip(scores[0], ids[0]):
+                if score < self.threshold:
+                    break
+                entry = self.entries[i]
+                if entry["namespace"] == namespace and not self._expired(entry, now):
+                    return self._hit(entry, float(score))
+
+        return None
+
+    def put(self,
+            query: str,
+            answer: str,
+            metadata: Dict[str, Any] = None,
+            namespace: str = "",
+            vector: Optional[Sequence[float]] = None) -> None:
+        """缓存一条问答，超出容量时淘汰最久未使用的条目"""
+        vector = self._embed(query, vector)
+
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexFlatIP(vector.shape[1])
+
+            now = time.time()
+            self._clock += 1
+            entry = {
+                "query": query,
+                "answer": answer,
+                "metadata": metadata or {},
+                "namespace": namespace,
+                "last_used": self._clock,
+                "created": now
+            }
+            self.index.add(vector)
+            self.entries.append(entry)
+            self._exact[(namespace, normalize_query(query))] = entry
+
+            # 先清理过期条目，仍超出容量时淘汰最久未使用的条目
+            if self.ttl is not None:
+                for i in range(len(self.entries) - 1, -1, -1):
+                    if self._expired(self.entries[i], now):
+                        self._remove(i)
+
+            if len(self.entries) > self.max_size:
+                lru = min(range(len(self.entries)), key=lambda i: self.entries[i]["last_used"])
+                self._remove(lru)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self.index = None
+            self.entries = []
+            self._exact = {}
+            self._clock = 0
+
+    def save(self) -> None:
+        """持久化缓存到 cache_dir"""
+        if not self.cache_dir:
+            return
+
+        try:
+            with self._lock:
+                if self.index is None:
+                    return
+                os.makedirs(self.cache_dir, exist_ok=True)
+                faiss.write_index(self.index, os.path.join(self.cache_dir, self.INDEX_FILE))
+                with open(os.path.join(self.cache_dir, self.ENTRIES_FILE), "w", encoding="utf-8") as f:
+                    json.dump(self.entries, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"⚠️ 保存语义缓存失败: {e}")
+
+    def load(self) -> None:
+        """从 cache_dir 加载缓存"""
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        entries_path = os.path.join(self.cache_dir, self.ENTRIES_FILE)
+        if not (os.path.exists(index_path) and os.path.exists(entries_path)):
+            return
+
+        try:
+            index = faiss.read_index(index_path)
+            with open(entries_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+
+            if index.ntotal != len(entries):
+                print("⚠️ 语义缓存文件不一致，已忽略")
+                return
+
+            now = time.time()
+            for entry in entries:
+                entry.setdefault("created", now)  # 旧版缓存文件没有创建时间
+
+            with self._lock:
+                self.index = index
+                self.entries = entries
+                self._exact = {(e["namespace"], normalize_query(e["query"])): e for e in entries}
+                self._clock = max((e["last_used"] for e in entries), default=0)
+            print(f"✅ 已加载 {len(entries)} 条语义缓存")
+        except Exception as e:
+            print(f"⚠️ 加载语义缓存失败: {e}")
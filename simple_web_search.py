@@ -1,32 +1,50 @@
 # simple_web_search.py - 简化的网络搜索功能
 
-import requests
-import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 from urllib.parse import quote
+from clients import HTTP
+from json_utils import loads
+
+WIKIPEDIA_SUMMARY_URL = "https://en.wikipedia.org/api/rest_v1/page/summary/{}"
+DUCKDUCKGO_API_URL = "https://api.duckduckgo.com/"
 
 
 class SimpleWebSearch:
     """简化的网络搜索功能"""
 
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        # 共用全局连接池（keep-alive）和默认请求头
+        self.session = HTTP
 
     def search_english_grammar(self, query: str, max_results: int = 3) -> List[Dict[str, Any]]:
-        """搜索英语语法相关内容"""
+        """搜索英语语法相关内容（维基百科和 DuckDuckGo 两个请求并发发出，总耗时约为较慢的一个）"""
         try:
-            # 使用维基百科API搜索
             enhanced_query = f"{query} English grammar"
 
-            # 维基百科搜索
-            wiki_results = self._search_wikipedia(enhanced_query)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                # 维基百科搜索
+                wiki_future = executor.submit(self._search_wikipedia, enhanced_query)
+                # DuckDuckGo API（简化版）
+                ddg_future = executor.submit(self._search_duckduckgo_simple, enhanced_query, max_results)
+
+                return wiki_future.result() + ddg_future.result()
+
+        except Exception as e:
+            print(f"搜索失败: {e}")
+            return []
 
-            # DuckDuckGo API（简化版）
-            ddg_results = self._search_duckduckgo_simple(enhanced_query, max_results)
+    async def search_english_grammar_async(self, query: str, max_results: int = 3) -> List[Dict[str, Any]]:
+        """搜索英语语法相关内容（异步接口，供事件循环中调用）"""
+        try:
+            enhanced_query = f"{query} English grammar"
 
+            # requests 是阻塞调用，放到线程池中并发执行，不阻塞事件循环
+            wiki_results, ddg_results = await asyncio.gather(
+                asyncio.to_thread(self._search_wikipedia, enhanced_query),
+                asyncio.to_thread(self._search_duckduckgo_simple, enhanced_query, max_results)
+            )
             return wiki_results + ddg_results
 
         except Exception as e:
@@ -37,12 +55,12 @@ class SimpleWebSearch:
         """搜索维基百科"""
         try:
             # 维基百科API
-            url = "https://en.wikipedia.org/api/rest_v1/page/summary/" + quote(query.replace(" ", "_"))
+            url = WIKIPEDIA_SUMMARY_URL.format(quote(query.replace(" ", "_")))
 
             response = self.session.get(url, timeout=10)
 
             if response.status_code == 200:
-                data = response.json()
+                data = loads(response.content)
                 return [{
                     "title": data.get("title", ""),
                     "content": data.get("extract", ""),
@@ -60,7 +78,6 @@ class SimpleWebSearch:
         """简化的DuckDuckGo搜索"""
         try:
             # 使用DuckDuckGo的即时答案API
-            url = "https://api.duckduckgo.com/"
             params = {
                 "q": query,
                 "format": "json",
@@ -68,10 +85,10 @@ class SimpleWebSearch:
                 "skip_disambig": 1
             }
 
-            response = self.session.get(url, params=params, timeout=10)
+            response = self.session.get(DUCKDUCKGO_API_URL, params=params, timeout=10)
             response.raise_for_status()
 
-            data = response.json()
+            data = loads(response.content)
             results = []
 
             # 主要摘要
@@ -1,14 +1,39 @@
 # test_retriever.py - 检索器测试和性能评估
 
 from retriever_enhanced import EnhancedRetriever
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
-from typing import List, Dict
-import json
+from typing import Dict
+from json_utils import JsonObjectWriter
 
+# 并发检索的线程数（瓶颈是 Ollama 向量化请求，与 OLLAMA_NUM_PARALLEL 对应）
+MAX_WORKERS = 8
 
-def test_retrieval_methods():
+
+def _timed_retrieval(retriever: EnhancedRetriever, query: str, method: str):
+    """执行一次检索并计时（在工作线程中运行），耗时单位为纳秒"""
+    start_ns = time.perf_counter_ns()
+    docs = retriever.get_relevant_documents(query, method=method)
+    return docs, time.perf_counter_ns() - start_ns
+
+
+def _run_retrievals(retriever: EnhancedRetriever, tasks) -> Dict:
+    """并发执行全部 (查询, 方法) 检索，返回 {(查询, 方法): (文档, 耗时纳秒) 或异常}"""
+    results = {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(_timed_retrieval, retriever, query, method): (query, method)
+                   for query, method in tasks}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = e
+    return results
+
+
+def test_retrieval_methods(retriever: EnhancedRetriever = None):
     """测试不同的检索方法"""
-    retriever = EnhancedRetriever()
+    retriever = retriever or EnhancedRetriever()
 
     # 测试查询
     test_queries = [
@@ -21,75 +46,91 @@ def test_retrieval_methods():
 
     print("🔍 RAG检索器性能测试")
     print("=" * 80)
+    # 类名以 Gpu 开头表示索引在GPU上（faiss-gpu）
+    print(f"🗂️ 索引: {type(retriever.db.index).__name__} | 向量数: {retriever.db.index.ntotal}")
 
-    results = {}
-
-    for query in test_queries:
-        print(f"\n📝 查询: {query}")
-        print("-" * 60)
-
-        query_results = {}
-
-        # 测试所有检索方法
-        methods = ["vector", "mmr", "enhanced"]
-        for method in methods:
-            start_time = time.time()
-            docs = retriever.get_relevant_documents(query, method=method)
-            response_time = time.time() - start_time
-
-            # 分析检索质量
-            quality = retriever.analyze_retrieval_quality(query, docs)
-
-            query_results[method] = {
-                "num_docs": len(docs),
-                "response_time": response_time,
-                "quality_score": quality["quality_score"],
-                "avg_content_length": quality["avg_content_length"],
-                "recommendations": quality["recommendations"],
-                "docs_preview": [doc.page_content[:100] + "..." for doc in docs[:2]]
-            }
+    # 所有查询一次请求批量向量化
+    start_ns = time.perf_counter_ns()
+    query_vectors = retriever.embeddings.embed_documents(test_queries)
+    print(f"⚡ 批量向量化 {len(test_queries)} 个查询: {(time.perf_counter_ns() - start_ns) / 1e9:.3f}s")
 
-            print(f"  {method.upper():10} | 文档: {len(docs):2d} | "
-                  f"质量: {quality['quality_score']:5.1f} | "
-                  f"时间: {response_time:.3f}s")
-
-            # 显示第一个文档预览
-            if docs:
-                print(f"             | 预览: {docs[0].page_content[:50]}...")
-
-        results[query] = query_results
-
-    # 保存结果
-    with open("retrieval_test_results.json", "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    # 每种检索方法对全部查询批量检索一次（向量检索只需一次 index.search），时间取每个查询的平均
+    methods = ["vector", "mmr", "enhanced"]
+    retrievals = {}
+    for method in methods:
+        start_ns = time.perf_counter_ns()
+        docs_list = retriever.batch_get_relevant_documents(test_queries, method, query_vectors)
+        response_ns = (time.perf_counter_ns() - start_ns) // len(test_queries)
+        for query, docs in zip(test_queries, docs_list):
+            retrievals[(query, method)] = (docs, response_ns)
+
+    # 每种方法的累计质量、时间、文档数（用于性能总结，不保留全部结果）
+    totals = {method: {"quality_score": 0.0, "response_ns": 0, "num_docs": 0} for method in methods}
+
+    # 每个查询的结果算完立即写入文件
+    with JsonObjectWriter("retrieval_test_results.json") as writer:
+        for query in test_queries:
+            print(f"\n📝 查询: {query}")
+            print("-" * 60)
+
+            query_results = {}
+
+            for method in methods:
+                docs, response_ns = retrievals[(query, method)]
+
+                # 分析检索质量
+                quality = retriever.analyze_retrieval_quality(query, docs)
+
+                query_results[method] = {
+                    "num_docs": len(docs),
+                    "response_ns": response_ns,
+                    "response_time": response_ns / 1e9,
+                    "quality_score": quality["quality_score"],
+                    "avg_content_length": quality["avg_content_length"],
+                    "recommendations": quality["recommendations"],
+                    "docs_preview": [doc.page_content[:100] + "..." for doc in docs[:2]]
+                }
+                for key in totals[method]:
+                    totals[method][key] += query_results[method][key]
+
+                print(f"  {method.upper():10} | 文档: {len(docs):2d} | "
+                      f"质量: {quality['quality_score']:5.1f} | "
+                      f"时间: {response_ns / 1e9:.3f}s")
+
+                # 显示第一个文档预览
+                if docs:
+                    print(f"             | 预览: {docs[0].page_content[:50]}...")
+
+            writer.write(query, query_results)
 
     print("\n📊 详细测试结果已保存到 retrieval_test_results.json")
 
     # 性能总结
     print("\n📈 性能总结")
     print("=" * 80)
-    for method in ["vector", "mmr", "enhanced"]:
-        avg_quality = sum(r[method]["quality_score"] for r in results.values()) / len(results)
-        avg_time = sum(r[method]["response_time"] for r in results.values()) / len(results)
-        avg_docs = sum(r[method]["num_docs"] for r in results.values()) / len(results)
+    for method in methods:
+        avg_quality = totals[method]["quality_score"] / len(test_queries)
+        avg_time = totals[method]["response_ns"] / len(test_queries) / 1e9
+        avg_docs = totals[method]["num_docs"] / len(test_queries)
 
         print(f"{method.upper():10} | 平均质量: {avg_quality:6.1f} | "
               f"平均时间: {avg_time:.3f}s | 平均文档数: {avg_docs:.1f}")
 
 
-def compare_retrieval_results():
+def compare_retrieval_results(retriever: EnhancedRetriever = None):
     """比较不同检索方法的结果差异"""
-    retriever = EnhancedRetriever()
+    retriever = retriever or EnhancedRetriever()
     query = "现在完成时的用法"
 
     print(f"\n🔄 检索结果比较: '{query}'")
     print("=" * 80)
 
     methods = ["vector", "mmr", "enhanced"]
+    retrievals = _run_retrievals(retriever, [(query, method) for method in methods])
     all_docs = {}
 
     for method in methods:
-        docs = retriever.get_relevant_documents(query, method=method)
+        docs, _ = retrievals[(query, method)]
         all_docs[method] = docs
 
         print(f"\n{method.upper()} 检索结果 ({len(docs)}个文档):")
@@ -112,9 +153,9 @@ def compare_retrieval_results():
     print(f"  MMR ∩ Enhanced: {overlap_mmr_enhanced}/{min(len(mmr_contents), len(enhanced_contents))}")
 
 
-def test_edge_cases():
+def test_edge_cases(retriever: EnhancedRetriever = None):
     """测试边界情况"""
-    retriever = EnhancedRetriever()
+    retriever = retriever or EnhancedRetriever()
 
     print("\n🧪 边界情况测试")
     print("=" * 80)
@@ -127,10 +168,15 @@ def test_edge_cases():
         "不相关的内容xyz",  # 不相关内容
     ]
 
+    retrievals = _run_retrievals(retriever, [(query, "enhanced") for query in edge_cases])
+
     for query in edge_cases:
         print(f"\n测试查询: '{query[:50]}{'...' if len(query) > 50 else ''}'")
         try:
-            docs = retriever.get_relevant_documents(query, method="enhanced")
+            result = retrievals[(query, "enhanced")]
+            if isinstance(result, Exception):
+                raise result
+            docs, _ = result
             quality = retriever.analyze_retrieval_quality(query, docs)
 
             print(f"  结果数量: {len(docs)}")
@@ -144,9 +190,12 @@ def test_edge_cases():
 if __name__ == "__main__":
     print("🚀 开始RAG检索器测试\n")
 
+    # 所有测试共用一个检索器：索引只加载一次（有GPU时只复制到显存一次）
+    retriever = EnhancedRetriever()
+
     # 运行所有测试
-    test_retrieval_methods()
-    compare_retrieval_results()
-    test_edge_cases()
+    test_retrieval_methods(retriever)
+    compare_retrieval_results(retriever)
+    test_edge_cases(retriever)
 
     print("\n✅ 测试完成！")
\ No newline at end of file
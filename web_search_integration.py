@@ -1,69 +1,251 @@
 # web_search_integration.py - 网络检索集成模块
 
-import requests
+import asyncio
+import hashlib
 import re
-from typing import List, Dict, Any, Optional
-from bs4 import BeautifulSoup
-from urllib.parse import quote, urlparse
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+import requests
+from urllib.parse import quote, quote_plus, urlencode, urlparse
 from langchain_core.documents import Document
+from clients import HTTP, EMBEDDINGS, get_async_http
+from config import (HYBRID_CACHE_THRESHOLD, HYBRID_CACHE_MAX_SIZE, HYBRID_CACHE_TTL,
+                    HTTP_CACHE_TTL, HTTP_CACHE_MAX_SIZE,
+                    WEB_EXTRACT_CACHE_SIZE, WEB_EXTRACT_MAX_BYTES,
+                    WEB_HOST_RATE, WEB_HOST_BURST)
+from dedup import SimHashDeduper, content_hash, simhash
+from json_utils import loads
+from semantic_cache import SemanticCache
 import time
 import logging
 
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 正文区域的 class 匹配（模块加载时编译一次）
+_CONTENT_CLASS_RE = re.compile(r'content|main|body')
+
+# 英语学习相关查询的中文关键词，以及为简单查询追加的英文关键词
+_CN_KEYWORDS = ("英语", "语法", "用法", "时态", "冠词")
+_EN_SUFFIX = " English grammar rules examples"
+
+# 合并结果的来源优先级（本地文档在前）和总文档数上限
+_SOURCE_ORDER = {"local": 0, "web": 1}
+MAX_HYBRID_DOCS = 8
+
+# 搜索接口的响应缓存：(URL, 参数) → (过期时间, 响应体)，响应体为 None 表示 404
+# 同一查询在几分钟到几小时内结果不变，重复查询无需再次请求
+_response_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_response_cache_lock = threading.Lock()
+_MAX_AGE_RE = re.compile(r"(?:^|[,\s])max-age=(\d+)")
+_MISSING = object()
+
+
+def _response_cache_key(url: str, params: Optional[Dict[str, Any]]) -> tuple:
+    return url, frozenset(params.items()) if params else frozenset()
+
+
+def _response_ttl(cache_control: Optional[str]) -> int:
+    """由 Cache-Control 响应头得到缓存时间，没有 max-age 时使用默认值"""
+    if not cache_control:
+        return HTTP_CACHE_TTL
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    match = _MAX_AGE_RE.search(cache_control)
+    return int(match.group(1)) if match else HTTP_CACHE_TTL
+
+
+def _response_cache_lookup(key: tuple):
+    """返回缓存的响应体（可能为 None），未命中返回 _MISSING"""
+    with _response_cache_lock:
+        item = _response_cache.get(key)
+        if item is not None and time.monotonic() < item[0]:
+            _response_cache.move_to_end(key)
+            return item[1]
+        if item is not None:
+            del _response_cache[key]
+        return _MISSING
+
+
+def _response_cache_store(key: tuple, body: Optional[bytes], ttl: int) -> None:
+    if ttl <= 0:
+        return
+    with _response_cache_lock:
+        _response_cache[key] = (time.monotonic() + ttl, body)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > HTTP_CACHE_MAX_SIZE:
+            _response_cache.popitem(last=False)
+
+
+@lru_cache(maxsize=1024)
+def _enhance_query_cached(query: str) -> str:
+    """为英语学习查询添加相关关键词（纯函数，结果按查询缓存）"""
+    # 检查是否是英语学习相关查询（关键词都是中文，无需 lower()）
+    if any(keyword in query for keyword in _CN_KEYWORDS):
+        # 为简单的中文查询添加英文关键词
+        if len(query) < 20:
+            return query + _EN_SUFFIX
+
+    return query
+
+
+@lru_cache(maxsize=None)
+def _bs4_parser() -> str:
+    """没有 selectolax 时使用 BeautifulSoup，装了 lxml 则用比 html.parser 快得多的 lxml 解析"""
+    from bs4.builder import builder_registry
+    return "lxml" if builder_registry.lookup("lxml") else "html.parser"
+
+
+# 按主机限速的令牌桶：主机 → (剩余令牌数, 上次更新时间)，只有真正发出的请求才消耗令牌
+_host_buckets: Dict[str, Tuple[float, float]] = {}
+_host_buckets_lock = threading.Lock()
+
+
+def _acquire_host(url: str) -> float:
+    """从该主机的令牌桶取一个令牌，返回需要等待的秒数（令牌不足时预支，等待补充所需的时间）"""
+    host = urlparse(url).netloc
+    with _host_buckets_lock:
+        now = time.monotonic()
+        tokens, last = _host_buckets.get(host, (WEB_HOST_BURST, now))
+        tokens = min(WEB_HOST_BURST, tokens + (now - last) * WEB_HOST_RATE) - 1
+        _host_buckets[host] = (tokens, now)
+    return -tokens / WEB_HOST_RATE if tokens < 0 else 0.0
+
+
+def clear_response_cache() -> None:
+    """清空搜索接口的响应缓存"""
+    with _response_cache_lock:
+        _response_cache.clear()
+
+
+def _handle_response(key: tuple, url: str, status: int, body: bytes, cache_control: Optional[str]) -> Optional[Any]:
+    """缓存 200/404 响应并解析 JSON，其他状态码不缓存，返回 None"""
+    if status == 200:
+        _response_cache_store(key, body, _response_ttl(cache_control))
+        return loads(body)
+    if status == 404:
+        _response_cache_store(key, None, _response_ttl(cache_control))
+    else:
+        logger.warning(f"请求失败 {url}: HTTP {status}")
+    return None
+
 
 class WebSearchEngine:
     """网络搜索引擎基类"""
 
+    def __init__(self, session: requests.Session = HTTP):
+        # 默认共用全局连接池（keep-alive 复用TCP/TLS连接）
+        self.session = session
+
     def search(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
         """搜索网络内容"""
         raise NotImplementedError
 
+    async def search_async(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
+        """异步搜索网络内容（默认在线程池中执行同步搜索）"""
+        return await asyncio.to_thread(self.search, query, max_results)
+
+    def _get_json(self, url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 10) -> Optional[Any]:
+        """带缓存的 GET 请求，返回解析后的 JSON，非 200 响应返回 None"""
+        key = _response_cache_key(url, params)
+        body = _response_cache_lookup(key)
+        if body is not _MISSING:
+            return loads(body) if body is not None else None
+
+        # 未命中缓存才真正发出请求，按主机限速
+        wait = _acquire_host(url)
+        if wait > 0:
+            time.sleep(wait)
+
+        response = self.session.get(url, params=params, timeout=timeout)
+        return _handle_response(key, url, response.status_code, response.content,
+                                response.headers.get("Cache-Control"))
+
+    async def _get_json_async(self,
+                              url: str,
+                              params: Optional[Dict[str, Any]] = None,
+                              timeout: Optional[float] = None) -> Optional[Any]:
+        """_get_json 的异步版本（与同步请求共用同一份缓存）"""
+        key = _response_cache_key(url, params)
+        body = _response_cache_lookup(key)
+        if body is not _MISSING:
+            return loads(body) if body is not None else None
+
+        import aiohttp
+
+        # 未命中缓存才真正发出请求，按主机限速（只让出事件循环，不阻塞其他请求）
+        wait = _acquire_host(url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        # 未指定超时时使用会话的默认超时
+        kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        async with get_async_http().get(url, params=params, **kwargs) as response:
+            return _handle_response(key, url, response.status, await response.read(),
+                                    response.headers.get("Cache-Control"))
+
 
 class DuckDuckGoSearchEngine(WebSearchEngine):
     """DuckDuckGo 搜索引擎 - 免费且无需API密钥"""
 
-    def search(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
-        """使用DuckDuckGo进行搜索"""
-        try:
-            # DuckDuckGo Instant Answer API
-            url = "https://api.duckduckgo.com/"
-            params = {
-                "q": query,
-                "format": "json",
-                "no_html": 1,
-                "skip_disambig": 1
-            }
-
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-
-            data = response.json()
+    # DuckDuckGo Instant Answer API
+    API_URL = "https://api.duckduckgo.com/"
+    # 固定参数只编码一次，每次请求只需编码查询词
+    FIXED_PARAMS = urlencode({"format": "json", "no_html": 1, "skip_disambig": 1})
 
-            results = []
+    @classmethod
+    def _url(cls, query: str) -> str:
+        return f"{cls.API_URL}?{cls.FIXED_PARAMS}&q={quote_plus(query)}"
 
-            # 主要结果
-            if data.get("Abstract"):
+    @staticmethod
+    def _parse_results(data: Dict[str, Any], max_results: int) -> List[Dict[str, Any]]:
+        """解析 Instant Answer 接口返回的数据"""
+        results = []
+
+        # 主要结果
+        if data.get("Abstract"):
+            results.append({
+                "title": data.get("Heading", ""),
+                "content": data["Abstract"],
+                "url": data.get("AbstractURL", ""),
+                "source": "DuckDuckGo Abstract"
+            })
+
+        # 相关主题
+        for topic in data.get("RelatedTopics", [])[:max_results]:
+            if "Text" in topic:
                 results.append({
-                    "title": data.get("Heading", ""),
-                    "content": data["Abstract"],
-                    "url": data.get("AbstractURL", ""),
-                    "source": "DuckDuckGo Abstract"
+                    "title": topic.get("FirstURL", "").split("/")[-1].replace("_", " "),
+                    "content": topic["Text"],
+                    "url": topic.get("FirstURL", ""),
+                    "source": "DuckDuckGo Related"
                 })
 
-            # 相关主题
-            for topic in data.get("RelatedTopics", [])[:max_results]:
-                if "Text" in topic:
-                    results.append({
-                        "title": topic.get("FirstURL", "").split("/")[-1].replace("_", " "),
-                        "content": topic["Text"],
-                        "url": topic.get("FirstURL", ""),
-                        "source": "DuckDuckGo Related"
-                    })
+        return results[:max_results]
+
+    def search(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
+        """使用DuckDuckGo进行搜索"""
+        try:
+            data = self._get_json(self._url(query))
+            return self._parse_results(data, max_results) if data is not None else []
+
+        except Exception as e:
+            logger.error(f"DuckDuckGo搜索失败: {e}")
+            return []
 
-            return results[:max_results]
+    async def search_async(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
+        """使用DuckDuckGo进行搜索（异步）"""
+        try:
+            data = await self._get_json_async(self._url(query))
+            return self._parse_results(data, max_results) if data is not None else []
 
         except Exception as e:
             logger.error(f"DuckDuckGo搜索失败: {e}")
@@ -73,23 +255,64 @@ class DuckDuckGoSearchEngine(WebSearchEngine):
 class WikipediaSearchEngine(WebSearchEngine):
     """维基百科搜索引擎 - 适合学术内容"""
 
+    SUMMARY_URL = "https://en.wikipedia.org/api/rest_v1/page/summary/{}"
+    API_URL = "https://en.wikipedia.org/w/api.php"
+
+    @staticmethod
+    def _summary_result(data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "title": data.get("title", ""),
+            "content": data.get("extract", ""),
+            "url": data.get("content_urls", {}).get("desktop", {}).get("page", ""),
+            "source": "Wikipedia"
+        }
+
+    # 固定参数只编码一次，每次请求只需编码查询词/页面ID
+    SEARCH_PARAMS = urlencode({"action": "query", "list": "search", "utf8": 1, "format": "json"})
+    # pageids 用 | 分隔，一次请求获取所有页面的摘要（只取导语部分时最多20个页面）
+    EXTRACT_PARAMS = urlencode({"action": "query", "prop": "extracts", "exintro": 1, "explaintext": 1,
+                                "exlimit": "max", "utf8": 1, "format": "json"})
+
+    @classmethod
+    def _search_url(cls, query: str, max_results: int) -> str:
+        return f"{cls.API_URL}?{cls.SEARCH_PARAMS}&srlimit={max_results}&srsearch={quote_plus(query)}"
+
+    @staticmethod
+    def _search_hits(data: Dict[str, Any]) -> List[Tuple[str, int]]:
+        """搜索结果中的 (标题, 页面ID)"""
+        return [(item.get("title", ""), item["pageid"])
+                for item in data.get("query", {}).get("search", []) if item.get("pageid")]
+
+    @classmethod
+    def _extract_url(cls, page_ids: List[int]) -> str:
+        return f"{cls.API_URL}?{cls.EXTRACT_PARAMS}&pageids={'%7C'.join(str(page_id) for page_id in page_ids)}"
+
+    @staticmethod
+    def _extract_results(hits: List[Tuple[str, int]], data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """由页面摘要接口的返回数据构造结果（保持搜索排序，跳过没有摘要的页面）"""
+        pages = data.get("query", {}).get("pages", {})
+        results = []
+
+        for title, page_id in hits:
+            page = pages.get(str(page_id))
+            if page and page.get("extract"):
+                results.append({
+                    "title": title,
+                    "content": page["extract"],
+                    "url": f"https://en.wikipedia.org/wiki/{quote(title)}",
+                    "source": "Wikipedia"
+                })
+
+        return results
+
     def search(self, query: str, max_results: int = 3) -> List[Dict[str, Any]]:
         """搜索维基百科内容"""
         try:
             # 搜索维基百科页面
-            search_url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{quote(query)}"
-
-            response = requests.get(search_url, timeout=10)
-
-            if response.status_code == 200:
-                data = response.json()
+            data = self._get_json(self.SUMMARY_URL.format(quote(query)))
 
-                return [{
-                    "title": data.get("title", ""),
-                    "content": data.get("extract", ""),
-                    "url": data.get("content_urls", {}).get("desktop", {}).get("page", ""),
-                    "source": "Wikipedia"
-                }]
+            if data is not None:
+                return [self._summary_result(data)]
             else:
                 # 如果直接访问失败，尝试搜索
                 return self._search_wikipedia_fallback(query, max_results)
@@ -101,57 +324,50 @@ class WikipediaSearchEngine(WebSearchEngine):
     def _search_wikipedia_fallback(self, query: str, max_results: int) -> List[Dict[str, Any]]:
         """维基百科搜索后备方案"""
         try:
-            search_url = "https://en.wikipedia.org/w/api.php"
-            params = {
-                "action": "query",
-                "list": "search",
-                "srsearch": query,
-                "utf8": 1,
-                "format": "json",
-                "srlimit": max_results
-            }
-
-            response = requests.get(search_url, params=params, timeout=10)
-            response.raise_for_status()
-
-            data = response.json()
-            results = []
-
-            for item in data.get("query", {}).get("search", []):
-                title = item.get("title", "")
-                page_id = item.get("pageid", 0)
-
-                if page_id:
-                    # 获取页面摘要
-                    summary_url = "https://en.wikipedia.org/w/api.php"
-                    summary_params = {
-                        "action": "query",
-                        "prop": "extracts",
-                        "exintro": 1,
-                        "explaintext": 1,
-                        "pageids": page_id,
-                        "utf8": 1,
-                        "format": "json"
-                    }
+            data = self._get_json(self._search_url(query, max_results))
+            if data is None:
+                return []
+
+            hits = self._search_hits(data)
+            if not hits:
+                return []
+
+            # 获取页面摘要（所有页面一次请求）
+            extracts = self._get_json(self._extract_url([page_id for _, page_id in hits]), timeout=5)
+            return self._extract_results(hits, extracts) if extracts is not None else []
+
+        except Exception as e:
+            logger.error(f"维基百科后备搜索失败: {e}")
+            return []
 
-                    summary_response = requests.get(summary_url, params=summary_params, timeout=5)
-                    if summary_response.status_code == 200:
-                        summary_data = summary_response.json()
-                        pages = summary_data.get("query", {}).get("pages", {})
+    async def search_async(self, query: str, max_results: int = 3) -> List[Dict[str, Any]]:
+        """搜索维基百科内容（异步）"""
+        try:
+            data = await self._get_json_async(self.SUMMARY_URL.format(quote(query)))
+            if data is not None:
+                return [self._summary_result(data)]
 
-                        if str(page_id) in pages:
-                            page = pages[str(page_id)]
-                            content = page.get("extract", "")
+            # 如果直接访问失败，尝试搜索
+            return await self._search_wikipedia_fallback_async(query, max_results)
 
-                            if content:
-                                results.append({
-                                    "title": title,
-                                    "content": content,
-                                    "url": f"https://en.wikipedia.org/wiki/{quote(title)}",
-                                    "source": "Wikipedia"
-                                })
+        except Exception as e:
+            logger.error(f"维基百科搜索失败: {e}")
+            return []
 
-            return results
+    async def _search_wikipedia_fallback_async(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        """维基百科搜索后备方案（异步）"""
+        try:
+            data = await self._get_json_async(self._search_url(query, max_results))
+            if data is None:
+                return []
+
+            hits = self._search_hits(data)
+            if not hits:
+                return []
+
+            # 获取页面摘要（所有页面一次请求）
+            extracts = await self._get_json_async(self._extract_url([page_id for _, page_id in hits]), timeout=5)
+            return self._extract_results(hits, extracts) if extracts is not None else []
 
         except Exception as e:
             logger.error(f"维基百科后备搜索失败: {e}")
@@ -161,39 +377,67 @@ class WikipediaSearchEngine(WebSearchEngine):
 class WebContentExtractor:
     """网页内容提取器"""
 
-    @staticmethod
-    def extract_content(url: str, max_length: int = 2000) -> str:
-        """提取网页主要内容"""
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            }
+    # 不属于正文的元素
+    REMOVED_TAGS = ['script', 'style', 'nav', 'footer', 'header', 'aside']
 
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
+    def __init__(self, session: requests.Session = HTTP):
+        self.session = session
 
-            soup = BeautifulSoup(response.content, 'html.parser')
+        # (URL, ETag 或页面内容哈希) → 清理后的正文；HTML 解析是最耗时的一步，页面未变化时直接复用
+        # （解析树在提取时会被修改，缓存的是提取结果而不是解析树）
+        self._text_cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._text_cache_lock = threading.Lock()
 
-            # 移除不需要的元素
-            for element in soup(['script', 'style', 'nav', 'footer', 'header', 'aside']):
-                element.decompose()
+    @classmethod
+    def _extract_text_selectolax(cls, html: bytes) -> str:
+        """使用 selectolax（C 实现的 HTML 解析器）提取正文"""
+        tree = HTMLParser(html)
 
-            # 提取主要内容
-            content = ""
+        # 移除不需要的元素
+        for node in tree.css(", ".join(cls.REMOVED_TAGS)):
+            node.decompose()
 
-            # 尝试找到主要内容区域
-            main_content = soup.find('main') or soup.find('article') or soup.find('div', class_=re.compile(r'content|main|body'))
+        # 尝试找到主要内容区域
+        main_content = (tree.css_first("main") or tree.css_first("article")
+                        or tree.css_first("div[class*=content], div[class*=main], div[class*=body]"))
 
-            if main_content:
-                content = main_content.get_text(separator=' ', strip=True)
-            else:
-                # 提取所有段落
-                paragraphs = soup.find_all('p')
-                content = ' '.join([p.get_text(strip=True) for p in paragraphs])
+        if main_content:
+            return main_content.text(separator=" ", strip=True)
+        # 提取所有非空段落
+        return " ".join(text for text in (p.text(strip=True) for p in tree.css("p")) if text)
+
+    @classmethod
+    def _extract_text_bs4(cls, html: bytes) -> str:
+        """使用 BeautifulSoup 提取正文（只在提取网页时才导入 bs4，不拖慢模块加载）"""
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, _bs4_parser())
 
-            # 清理内容
-            content = re.sub(r'\s+', ' ', content)
-            content = content.strip()
+        # 移除不需要的元素
+        for element in soup(cls.REMOVED_TAGS):
+            element.decompose()
+
+        # 尝试找到主要内容区域
+        main_content = soup.find('main') or soup.find('article') or soup.find('div', class_=_CONTENT_CLASS_RE)
+
+        if main_content:
+            return main_content.get_text(separator=' ', strip=True)
+        # 提取所有非空段落（生成器直接拼接，不生成中间列表）
+        return ' '.join(text for text in (p.get_text(strip=True) for p in soup.find_all('p')) if text)
+
+    def extract_content(self, url: str, max_length: int = 2000) -> str:
+        """提取网页主要内容"""
+        try:
+            # 流式下载：先检查响应头，正文最多读取 WEB_EXTRACT_MAX_BYTES
+            with self.session.get(url, timeout=10, stream=True) as response:
+                response.raise_for_status()
+
+                content_type = response.headers.get("Content-Type", "")
+                if content_type and "html" not in content_type:
+                    logger.info(f"跳过非HTML页面 {url}: {content_type}")
+                    return ""
+
+                content = self._page_text(url, response)
 
             return content[:max_length] + "..." if len(content) > max_length else content
 
@@ -201,23 +445,107 @@ class WebContentExtractor:
             logger.error(f"网页内容提取失败 {url}: {e}")
             return ""
 
+    @staticmethod
+    def _read_html(response: requests.Response) -> bytes:
+        """读取页面内容，超过 WEB_EXTRACT_MAX_BYTES 即停止下载（截断的 HTML 同样可以解析）"""
+        buf = bytearray()
+        for chunk in response.iter_content(chunk_size=16384):
+            buf += chunk
+            if len(buf) >= WEB_EXTRACT_MAX_BYTES:
+                break
+        return bytes(buf[:WEB_EXTRACT_MAX_BYTES])
+
+    def _cached_text(self, key: tuple) -> Optional[str]:
+        with self._text_cache_lock:
+            content = self._text_cache.get(key)
+            if content is not None:
+                self._text_cache.move_to_end(key)
+            return content
+
+    def _page_text(self, url: str, response: requests.Response) -> str:
+        """解析页面并提取清理后的正文（按页面版本缓存）"""
+        # 有 ETag 时只看响应头即可命中缓存，无需下载页面内容
+        etag = response.headers.get("ETag")
+        if etag:
+            content = self._cached_text((url, etag))
+            if content is not None:
+                return content
+
+        html = self._read_html(response)
+        key = (url, etag or hashlib.blake2b(html, digest_size=16).digest())
+        if not etag:
+            content = self._cached_text(key)
+            if content is not None:
+                return content
+
+        if HTMLParser is not None:
+            content = self._extract_text_selectolax(html)
+        else:
+            content = self._extract_text_bs4(html)
+
+        # 清理内容：合并空白（split/join 比正则替换快，且已去掉首尾空白）
+        content = ' '.join(content.split())
+
+        with self._text_cache_lock:
+            self._text_cache[key] = content
+            while len(self._text_cache) > WEB_EXTRACT_CACHE_SIZE:
+                self._text_cache.popitem(last=False)
+
+        return content
+
 
 class HybridRAGSystem:
     """混合RAG系统 - 结合本地知识库和网络检索"""
 
-    def __init__(self, local_retriever, enable_web_search: bool = True):
+    def __init__(self, local_retriever, enable_web_search: bool = True, session: requests.Session = HTTP):
         self.local_retriever = local_retriever
         self.enable_web_search = enable_web_search
 
-        # 初始化搜索引擎
+        # 初始化搜索引擎（各引擎和内容提取器共用同一连接池）
         self.search_engines = [
-            DuckDuckGoSearchEngine(),
-            WikipediaSearchEngine()
+            DuckDuckGoSearchEngine(session),
+            WikipediaSearchEngine(session)
         ]
 
-        self.content_extractor = WebContentExtractor()
-
-    def search_and_retrieve(self, query: str, use_local: bool = True, use_web: bool = True) -> List[Document]:
+        self.content_extractor = WebContentExtractor(session)
+
+        # 检索结果缓存（仅内存）：近似重复的查询跳过本地检索和网络搜索
+        # 使用与本地检索相同的向量模型，查询向量可在两者间复用
+        self.embeddings = getattr(local_retriever, "embeddings", None) or EMBEDDINGS
+        self.retrieval_cache = SemanticCache(
+            self.embeddings,
+            threshold=HYBRID_CACHE_THRESHOLD,
+            max_size=HYBRID_CACHE_MAX_SIZE,
+            ttl=HYBRID_CACHE_TTL
+        )
+
+    def _cache_namespace(self, use_local: bool, use_web: bool) -> Optional[str]:
+        """按实际启用的检索来源划分缓存命名空间，两者都未启用时不缓存"""
+        use_local = use_local and self.local_retriever is not None
+        use_web = use_web and self.enable_web_search
+        if not (use_local or use_web):
+            return None
+        return f"local={use_local},web={use_web}"
+
+    def _cache_get(self, query: str, namespace: Optional[str], query_vector: List[float]) -> Optional[List[Document]]:
+        if namespace is None:
+            return None
+        cached = self.retrieval_cache.get(query, namespace=namespace, vector=query_vector)
+        if cached is None:
+            return None
+        logger.info(f"命中检索缓存 (相似度 {cached['score']:.3f})")
+        return list(cached["metadata"]["docs"])
+
+    def _cache_put(self, query: str, namespace: Optional[str], query_vector: List[float], docs: List[Document]) -> None:
+        # 检索为空多半是网络暂时失败，不缓存
+        if namespace is not None and docs:
+            self.retrieval_cache.put(query, "", {"docs": docs}, namespace=namespace, vector=query_vector)
+
+    def search_and_retrieve(self,
+                            query: str,
+                            use_local: bool = True,
+                            use_web: bool = True,
+                            query_vector: Optional[List[float]] = None) -> List[Document]:
         """
         混合检索：结合本地和网络搜索
 
@@ -225,25 +553,24 @@ class HybridRAGSystem:
             query: 查询字符串
             use_local: 是否使用本地检索
             use_web: 是否使用网络检索
+            query_vector: 已计算好的查询向量（可选，检索缓存和本地检索共用，只向量化一次）
 
         Returns:
             合并后的文档列表
         """
+        # 0. 检索缓存
+        namespace = self._cache_namespace(use_local, use_web)
+        if namespace is not None and query_vector is None:
+            query_vector = self.embeddings.embed_query(query)
+        cached = self._cache_get(query, namespace, query_vector)
+        if cached is not None:
+            return cached
+
         all_docs = []
 
         # 1. 本地知识库检索
         if use_local and self.local_retriever:
-            try:
-                local_docs = self.local_retriever.get_relevant_documents(query, method="enhanced")
-                for doc in local_docs:
-                    doc.metadata.update({
-                        "source_type": "local",
-                        "retrieval_method": "vector_search"
-                    })
-                all_docs.extend(local_docs)
-                logger.info(f"本地检索到 {len(local_docs)} 个文档")
-            except Exception as e:
-                logger.error(f"本地检索失败: {e}")
+            all_docs.extend(self._local_search(query, query_vector))
 
         # 2. 网络搜索
         if use_web and self.enable_web_search:
@@ -252,7 +579,85 @@ class HybridRAGSystem:
             logger.info(f"网络搜索到 {len(web_docs)} 个文档")
 
         # 3. 去重和排序
-        return self._deduplicate_and_rank(all_docs)
+        docs = self._deduplicate_and_rank(all_docs)
+        self._cache_put(query, namespace, query_vector, docs)
+        return list(docs)
+
+    def batch_search_and_retrieve(self,
+                                  queries: List[str],
+                                  use_local: bool = True,
+                                  use_web: bool = True) -> List[List[Document]]:
+        """批量混合检索：所有查询一次请求完成向量化，再逐个检索（复用各自的向量）"""
+        if not queries:
+            return []
+
+        if self._cache_namespace(use_local, use_web) is None:
+            query_vectors = [None] * len(queries)
+        else:
+            query_vectors = self.embeddings.embed_documents(queries)
+
+        return [self.search_and_retrieve(query, use_local, use_web, query_vector)
+                for query, query_vector in zip(queries, query_vectors)]
+
+    async def asearch_and_retrieve(self,
+                                   query: str,
+                                   use_local: bool = True,
+                                   use_web: bool = True,
+                                   query_vector: Optional[List[float]] = None) -> List[Document]:
+        """
+        混合检索（异步）：本地检索（CPU，在线程池中执行）与网络搜索（事件循环上的异步请求）
+        互不依赖，并发执行，总耗时约为两者中的较大值
+
+        Args:
+            query: 查询字符串
+            use_local: 是否使用本地检索
+            use_web: 是否使用网络检索
+            query_vector: 已计算好的查询向量（可选，本地检索直接复用）
+
+        Returns:
+            合并后的文档列表
+        """
+        # 检索缓存
+        namespace = self._cache_namespace(use_local, use_web)
+        if namespace is not None and query_vector is None:
+            query_vector = await self.embeddings.aembed_query(query)
+        cached = self._cache_get(query, namespace, query_vector)
+        if cached is not None:
+            return cached
+
+        async def _local() -> List[Document]:
+            if use_local and self.local_retriever:
+                return await asyncio.to_thread(self._local_search, query, query_vector)
+            return []
+
+        async def _web() -> List[Document]:
+            if use_web and self.enable_web_search:
+                web_docs = await self._aweb_search(query)
+                logger.info(f"网络搜索到 {len(web_docs)} 个文档")
+                return web_docs
+            return []
+
+        local_docs, web_docs = await asyncio.gather(_local(), _web())
+
+        # 去重和排序
+        docs = self._deduplicate_and_rank(local_docs + web_docs)
+        self._cache_put(query, namespace, query_vector, docs)
+        return list(docs)
+
+    def _local_search(self, query: str, query_vector: Optional[List[float]] = None) -> List[Document]:
+        """本地知识库检索"""
+        try:
+            local_docs = self.local_retriever.get_relevant_documents(query, "enhanced", query_vector)
+            for doc in local_docs:
+                doc.metadata.update({
+                    "source_type": "local",
+                    "retrieval_method": "vector_search"
+                })
+            logger.info(f"本地检索到 {len(local_docs)} 个文档")
+            return local_docs
+        except Exception as e:
+            logger.error(f"本地检索失败: {e}")
+            return []
 
     def _web_search(self, query: str, max_results_per_engine: int = 2) -> List[Document]:
         """执行网络搜索"""
@@ -264,74 +669,78 @@ class HybridRAGSystem:
         for engine in self.search_engines:
             try:
                 results = engine.search(enhanced_query, max_results_per_engine)
-
-                for result in results:
-                    content = result.get("content", "")
-                    title = result.get("title", "")
-                    url = result.get("url", "")
-                    source = result.get("source", "web")
-
-                    if content and len(content) > 50:  # 过滤太短的内容
-                        doc = Document(
-                            page_content=content,
-                            metadata={
-                                "source": url,
-                                "title": title,
-                                "source_type": "web",
-                                "engine": source,
-                                "query": enhanced_query
-                            }
-                        )
-                        web_docs.append(doc)
-
-                # 避免请求过于频繁
-                time.sleep(1)
+                web_docs.extend(self._results_to_docs(results, enhanced_query))
 
             except Exception as e:
                 logger.error(f"网络搜索失败 {engine.__class__.__name__}: {e}")
 
         return web_docs
 
-    def _enhance_query(self, query: str) -> str:
-        """为英语学习查询添加相关关键词"""
-        english_keywords = [
-            "English grammar", "ESL", "English learning",
-            "English usage", "grammar rules"
-        ]
+    async def _aweb_search(self, query: str, max_results_per_engine: int = 2) -> List[Document]:
+        """执行网络搜索（异步）：各搜索引擎访问不同主机，并发请求，总耗时约为最慢的一个"""
+        enhanced_query = self._enhance_query(query)
+
+        results_per_engine = await asyncio.gather(
+            *(engine.search_async(enhanced_query, max_results_per_engine) for engine in self.search_engines),
+            return_exceptions=True
+        )
+
+        web_docs = []
+        for engine, results in zip(self.search_engines, results_per_engine):
+            if isinstance(results, Exception):
+                logger.error(f"网络搜索失败 {engine.__class__.__name__}: {results}")
+                continue
+            web_docs.extend(self._results_to_docs(results, enhanced_query))
+
+        return web_docs
 
-        # 检查是否是英语学习相关查询
-        if any(keyword in query.lower() for keyword in ["英语", "语法", "用法", "时态", "冠词"]):
-            # 为简单的中文查询添加英文关键词
-            if len(query) < 20:
-                return f"{query} English grammar rules examples"
+    @staticmethod
+    def _results_to_docs(results: List[Dict[str, Any]], query: str) -> List[Document]:
+        """搜索结果转换为文档（过滤太短的内容）"""
+        docs = []
+        for result in results:
+            content = result.get("content", "").strip()
+
+            if content and len(content) > 50:
+                docs.append(Document(
+                    page_content=content,
+                    metadata={
+                        "source": result.get("url", ""),
+                        "title": result.get("title", ""),
+                        "source_type": "web",
+                        "engine": result.get("source", "web"),
+                        "query": query
+                    }
+                ))
+        return docs
 
-        return query
+    def _enhance_query(self, query: str) -> str:
+        """为英语学习查询添加相关关键词"""
+        return _enhance_query_cached(query)
 
     def _deduplicate_and_rank(self, docs: List[Document]) -> List[Document]:
         """去重和排序文档"""
-        # 简单去重：基于内容前100字符
+        # 完全相同的内容先按全文哈希快速排除，其余做近重复去重：基于 SimHash 签名（改写过的相同片段也能识别）
         unique_docs = []
-        seen_content = set()
+        seen = set()
+        deduper = SimHashDeduper()
 
-        # 优先本地文档，然后网络文档
-        local_docs = [doc for doc in docs if doc.metadata.get("source_type") == "local"]
-        web_docs = [doc for doc in docs if doc.metadata.get("source_type") == "web"]
+        # 优先本地文档，然后网络文档（稳定排序，同一来源内保持检索顺序）
+        ordered = sorted((doc for doc in docs if doc.metadata.get("source_type") in _SOURCE_ORDER),
+                         key=lambda doc: _SOURCE_ORDER[doc.metadata["source_type"]])
 
-        # 先添加本地文档
-        for doc in local_docs:
-            content = doc.page_content[:100]
-            if content not in seen_content:
-                seen_content.add(content)
-                unique_docs.append(doc)
+        for doc in ordered:
+            key = content_hash(doc.page_content)
+            if key in seen:
+                continue
+            seen.add(key)
 
-        # 再添加网络文档
-        for doc in web_docs:
-            content = doc.page_content[:100]
-            if content not in seen_content:
-                seen_content.add(content)
+            if deduper.add(simhash(doc.page_content)):
                 unique_docs.append(doc)
+                if len(unique_docs) == MAX_HYBRID_DOCS:  # 限制总文档数量
+                    break
 
-        return unique_docs[:8]  # 限制总文档数量
+        return unique_docs
 
 
 def create_hybrid_retriever(local_retriever, enable_web_search: bool = True) -> HybridRAGSystem: